@@ -8,23 +8,124 @@ import os
 # Add current directory to Python path
 sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
 
-from flask import Flask, render_template, request, session, redirect, url_for, jsonify, flash
+from flask import Flask, Response, render_template, stream_template, request, session, redirect, url_for, jsonify, flash, get_flashed_messages, g
+from flask.json.provider import JSONProvider, DefaultJSONProvider
+from jinja2 import FileSystemBytecodeCache
 import uuid
+import calendar
+import time
+from types import MappingProxyType
 from typing import Dict, Optional
+from dataclasses import dataclass
 from functools import wraps
 
-from casino_game import CasinoRideTheBus, GameState, Round
-from user_manager import UserManager
+from casino_game import CasinoRideTheBus, GameStatus
+from user_manager import UserManager, USER_CACHE_TTL
+from money import STARTING_BANKROLL_CENTS, to_cents, from_cents, format_cents
+from game_store import create_game_store
+
+try:
+    import orjson
+except ImportError:  # orjson is optional; Flask's stdlib-json provider is used without it
+    orjson = None
+
+
+class ORJSONProvider(JSONProvider):
+    """JSON provider backed by orjson for faster jsonify() and request.json."""
+    mimetype = "application/json"
+    option = orjson.OPT_NON_STR_KEYS if orjson else 0
+
+    def __init__(self, app):
+        super().__init__(app)
+        # Handles the json.dumps/json.loads arguments orjson has no equivalent for
+        self._fallback = DefaultJSONProvider(app)
+
+    def dumps(self, obj, **kwargs) -> str:
+        if kwargs.keys() - {'default', 'sort_keys'}:
+            return self._fallback.dumps(obj, **kwargs)
+        option = self.option | (orjson.OPT_SORT_KEYS if kwargs.get('sort_keys') else 0)
+        return orjson.dumps(obj, default=kwargs.get('default'), option=option).decode()
+
+    def loads(self, s, **kwargs):
+        if kwargs:
+            return self._fallback.loads(s, **kwargs)
+        return orjson.loads(s)
+
+    def response(self, *args, **kwargs):
+        # Hand orjson's bytes straight to the response, skipping the str round-trip
+        obj = self._prepare_response_obj(args, kwargs)
+        return self._app.response_class(orjson.dumps(obj, option=self.option), mimetype=self.mimetype)
+
+
+def format_timestamp(value, fmt: str = '%m/%d/%Y %I:%M %p') -> str:
+    """Jinja filter: show a stored timestamp (epoch seconds, or SQLite's UTC
+    "YYYY-MM-DD HH:MM:SS" text) in local time; other text passes through."""
+    if not isinstance(value, (int, float)):
+        try:
+            value = calendar.timegm(time.strptime(value, '%Y-%m-%d %H:%M:%S'))
+        except (TypeError, ValueError):
+            return value
+    return time.strftime(fmt, time.localtime(value))
 
 
 app = Flask(__name__)
 app.config['SECRET_KEY'] = 'casino-ride-the-bus-secret-key'
+if orjson is not None:
+    app.json = ORJSONProvider(app)
+
+# Share compiled templates across workers and restarts, then compile the rest up front
+# (template auto-reload already follows debug mode, so production skips the stat() calls)
+app.jinja_env.bytecode_cache = FileSystemBytecodeCache(os.getenv('JINJA_CACHE_DIR'))
+app.jinja_env.filters['cents'] = format_cents  # {{ amount_cents|cents }} -> "10.50"
+app.jinja_env.filters['timestamp'] = format_timestamp  # {{ user.last_login|timestamp }}
+for template_name in app.jinja_env.list_templates(extensions=['html']):
+    app.jinja_env.get_template(template_name)
 
-# Initialize user manager
-user_manager = UserManager()
+# Initialize user manager. Its user-row cache is per process and can't see other workers'
+# writes, so it is off when REDIS_URL marks a multi-worker deployment
+user_cache_ttl = float(os.getenv('USER_CACHE_TTL', 0 if os.getenv('REDIS_URL') else USER_CACHE_TTL))
+user_manager = UserManager(os.getenv('CASINO_DB_PATH', 'casino_users.db'), user_cache_ttl=user_cache_ttl)
 
-# In-memory storage for active games
-active_games: Dict[str, GameState] = {}
+# The engine keeps no per-game state (everything lives on GameState), so one is shared
+engine = CasinoRideTheBus()
+
+# Storage for active games (in-memory by default, Redis when REDIS_URL is set)
+game_store = create_game_store()
+
+
+@dataclass(slots=True)
+class GuessResponse:
+    """Body of a successful /make_guess response"""
+    success: bool
+    correct: bool
+    card: str
+    card_rank: str
+    card_suit: str
+    card_color: str
+    winnings: float  # dollars; the engine counts in cents
+    status: str
+    round: Optional[int]
+
+
+@dataclass(slots=True)
+class CashOutResponse:
+    """Body of a successful /cash_out response"""
+    success: bool
+    winnings: float  # dollars; the engine counts in cents
+    status: str
+
+
+# Resolved URLs of argument-less endpoints, keyed by (script root, endpoint)
+_static_urls: Dict[tuple, str] = {}
+
+
+def static_url_for(endpoint: str) -> str:
+    """url_for() for routes without arguments, resolved once per mount point."""
+    key = (request.script_root, endpoint)
+    url = _static_urls.get(key)
+    if url is None:
+        url = _static_urls[key] = url_for(endpoint)
+    return url
 
 
 def login_required(f):
@@ -33,47 +134,96 @@ def login_required(f):
     def decorated_function(*args, **kwargs):
         if 'user_id' not in session:
             flash('Please log in to access this page.', 'error')
-            return redirect(url_for('login'))
+            return redirect(static_url_for('login'))
         return f(*args, **kwargs)
     return decorated_function
 
 
+def with_game_lock(f):
+    """Decorator to run one move at a time per game; a concurrent move gets a 409."""
+    @wraps(f)
+    def decorated_function(*args, **kwargs):
+        game_id = session.get('game_id')
+        if not game_id:
+            return f(*args, **kwargs)
+        token = game_store.acquire(game_id)
+        if token is None:
+            return jsonify({'error': 'Another move for this game is in progress'}), 409
+        try:
+            return f(*args, **kwargs)
+        finally:
+            game_store.release(game_id, token)
+    return decorated_function
+
+
 def get_current_user():
     """Get current user from session."""
     if 'user_id' in session:
         return user_manager.get_user_by_id(session['user_id'])
     return None
 
+# Fields every guest shares; only id and bankroll vary per session
+_GUEST_DEFAULTS = MappingProxyType({
+    'username': 'Guest',
+    'email': 'guest@casino.com',
+    'total_wagered_cents': 0,
+    'total_won_cents': 0,
+    'games_played': 0,
+    'games_won': 0,
+    'created_at': 'Guest Session',
+    'last_login': 'Current Session'
+})
+
+
 def get_current_user_or_guest():
-    """Get current user or create/return guest user."""
+    """Get current user or create/return guest user (resolved once per request)."""
+    cached = g.get('current_user')
+    if cached is not None:
+        return cached
+    
     user = get_current_user()
     if user:
-        return user, False  # (user, is_guest)
+        g.current_user = (user, False)  # (user, is_guest)
+        return g.current_user
     
     # Create or get guest session
     if 'guest_id' not in session:
         session['guest_id'] = str(uuid.uuid4())
-        session['guest_bankroll'] = 1000.0  # Starting guest bankroll
+        session['guest_bankroll_cents'] = STARTING_BANKROLL_CENTS
     
     guest_user = {
+        **_GUEST_DEFAULTS,
         'id': session['guest_id'],
-        'username': 'Guest',
-        'email': 'guest@casino.com',
-        'bankroll': session.get('guest_bankroll', 1000.0),
-        'total_wagered': 0.0,
-        'total_won': 0.0,
-        'games_played': 0,
-        'games_won': 0,
-        'created_at': 'Guest Session',
-        'last_login': 'Current Session'
+        'bankroll_cents': session.get('guest_bankroll_cents', STARTING_BANKROLL_CENTS)
     }
     
-    return guest_user, True  # (guest_user, is_guest)
+    g.current_user = (guest_user, True)  # (guest_user, is_guest)
+    return g.current_user
+
+
+# Rendered landing page for visitors with no account, guest session or flashes,
+# keyed by script root; skipped while templates auto-reload (debug mode)
+_anon_landing_pages: Dict[str, str] = {}
+
+
+def anon_landing_page() -> str:
+    """Landing page as first-time visitors see it, rendered once per mount point."""
+    if app.jinja_env.auto_reload:
+        return render_template('casino_landing.html', user=None, is_guest=False)
+    page = _anon_landing_pages.get(request.script_root)
+    if page is None:
+        page = _anon_landing_pages[request.script_root] = render_template(
+            'casino_landing.html', user=None, is_guest=False)
+    return page
 
 
 @app.route('/')
 def landing():
     """Landing page - now accessible to both guests and users."""
+    # First-time visitors get the shared page; a guest session starts from its button
+    if 'user_id' not in session and 'guest_id' not in session and '_flashes' not in session:
+        return anon_landing_page()
+    
     # Use get_current_user_or_guest to handle both logged-in users and guest sessions
     user, is_guest = get_current_user_or_guest()
     
@@ -81,10 +231,9 @@ def landing():
         # Check for daily bonus for registered users only
         bonus = user_manager.claim_daily_bonus(user['id'])
         if bonus > 0:
-            flash(f'Daily bonus claimed: ${bonus:.2f}!', 'success')
+            flash(f'Daily bonus claimed: ${format_cents(bonus)}!', 'success')
     
     # Show landing page to everyone (guests and registered users)
-    # Note: user might be None for first-time visitors
     return render_template('casino_landing.html', user=user, is_guest=is_guest)
 
 
@@ -95,12 +244,12 @@ def login():
         username = request.form['username']
         password = request.form['password']
         
-        if user_manager.authenticate_user(username, password):
-            user = user_manager.get_user_by_username(username)
+        user = user_manager.authenticate_user(username, password)
+        if user:
             session['user_id'] = user['id']
             session['username'] = user['username']
             flash(f'Welcome back, {username}!', 'success')
-            return redirect(url_for('landing'))
+            return redirect(static_url_for('landing'))
         else:
             flash('Invalid username or password.', 'error')
     
@@ -123,7 +272,7 @@ def register():
         success, message = user_manager.create_user(username, email, password)
         if success:
             flash('Registration successful! Please log in.', 'success')
-            return redirect(url_for('login'))
+            return redirect(static_url_for('login'))
         else:
             flash(message, 'error')
     
@@ -136,7 +285,7 @@ def logout():
     username = session.get('username', 'User')
     session.clear()
     flash(f'Goodbye, {username}!', 'info')
-    return redirect(url_for('login'))
+    return redirect(static_url_for('login'))
 
 
 @app.route('/profile')
@@ -146,26 +295,28 @@ def profile():
     user = get_current_user()
     stats = user_manager.get_user_statistics(user['id'])
     recent_games = user_manager.get_game_history(user['id'], limit=10)
-    leaderboard = user_manager.get_leaderboard()
     
-    return render_template('profile.html', 
-                         user=user, 
-                         stats=stats, 
-                         recent_games=recent_games,
-                         leaderboard=leaderboard)
+    # Stream the page so the header and stats reach the browser while the
+    # leaderboard rows are still being read. The session cookie is saved before a
+    # streamed body runs, so pop the flashes here or they would never be cleared
+    return Response(stream_template('profile.html', 
+                                    user=user, 
+                                    stats=stats, 
+                                    recent_games=recent_games,
+                                    flashed_messages=get_flashed_messages(with_categories=True),
+                                    leaderboard=user_manager.iter_leaderboard()),
+                    mimetype='text/html')
 
 
 @app.route('/game')
 def game():
     """Main game interface - accessible to guests and users."""
     user, is_guest = get_current_user_or_guest()
-    game_id = session.get('game_id')
+    game_state = game_store.get(session.get('game_id', ''))
     
-    if not game_id or game_id not in active_games:
-        return redirect(url_for('landing'))
+    if game_state is None:
+        return redirect(static_url_for('landing'))
     
-    game_state = active_games[game_id]
-    engine = CasinoRideTheBus()
     strategy = engine.get_strategy_recommendation(game_state)
     
     return render_template('casino_game.html', 
@@ -179,128 +330,128 @@ def game():
 def start_game():
     """Start a new game with specified bet amount - accessible to guests and users."""
     user, is_guest = get_current_user_or_guest()
-    bet_amount = float(request.form.get('bet_amount', 10.0))
+    bet_cents = to_cents(request.form.get('bet_amount', 10.0))
     
-    if bet_amount <= 0:
+    if bet_cents <= 0:
         flash('Invalid bet amount.', 'error')
-        return redirect(url_for('landing'))
+        return redirect(static_url_for('landing'))
     
-    if bet_amount > user['bankroll']:
+    if bet_cents > user['bankroll_cents']:
         flash('Insufficient funds!', 'error')
-        return redirect(url_for('landing'))
+        return redirect(static_url_for('landing'))
     
     # Deduct bet from bankroll
     if is_guest:
-        session['guest_bankroll'] = user['bankroll'] - bet_amount
-    else:
-        user_manager.update_bankroll(user['id'], user['bankroll'] - bet_amount)
+        session['guest_bankroll_cents'] = user['bankroll_cents'] - bet_cents
+    elif user_manager.adjust_bankroll(user['id'], -bet_cents) is None:
+        flash('Insufficient funds!', 'error')
+        return redirect(static_url_for('landing'))
     
-    engine = CasinoRideTheBus()
-    game_state = engine.start_new_game(bet_amount)
+    game_state = engine.start_new_game(bet_cents)
     
-    active_games[game_state.game_id] = game_state
+    game_store.expire()
+    game_store.set(game_state.game_id, game_state)
     session['game_id'] = game_state.game_id
     
-    return redirect(url_for('game'))
+    return redirect(static_url_for('game'))
 
 
 @app.route('/make_guess', methods=['POST'])
+@with_game_lock
 def make_guess():
     """Make a guess for the current round - accessible to guests and users."""
     user, is_guest = get_current_user_or_guest()
     game_id = session.get('game_id')
     
-    if not game_id or game_id not in active_games:
+    if not game_id:
         return jsonify({'error': 'No active game'}), 400
     
     guess = request.json.get('guess')
     if not guess:
         return jsonify({'error': 'No guess provided'}), 400
     
-    game_state = active_games[game_id]
-    engine = CasinoRideTheBus()
+    game_state = game_store.get(game_id)
+    if game_state is None:
+        return jsonify({'error': 'Game expired, please start a new game'}), 400
     
     try:
         is_correct, card, winnings = engine.make_guess(game_state, guess)
+        game_store.set(game_id, game_state)
         
         # If game is finished, handle results
-        if game_state.status.value in ['won', 'lost']:
+        if game_state.status in (GameStatus.WON, GameStatus.LOST):
             if not is_guest:
-                # Record game for registered users only
-                user_manager.record_game(
+                # Record game and credit winnings for registered users in one transaction
+                if not user_manager.finalize_game(
                     user_id=user['id'],
                     game_id=game_state.game_id,
-                    bet_amount=game_state.bet_amount,
-                    final_winnings=game_state.current_winnings,
+                    bet_cents=game_state.bet_cents,
+                    winnings_cents=game_state.winnings_cents,
                     rounds_completed=len(game_state.cards_drawn),
-                    result=game_state.status.value
-                )
-            
-            # Add winnings to bankroll
-            if game_state.current_winnings > 0:
-                if is_guest:
-                    session['guest_bankroll'] = session.get('guest_bankroll', 1000.0) + game_state.current_winnings
-                else:
-                    current_user = user_manager.get_user_by_id(user['id'])
-                    user_manager.update_bankroll(
-                        user['id'], 
-                        current_user['bankroll'] + game_state.current_winnings
-                    )
+                    result=game_state.status.value,
+                    bankroll_delta_cents=game_state.winnings_cents,
+                    cards_drawn=[card.code for card in game_state.cards_drawn]
+                ):
+                    return jsonify({'error': 'Could not record game'}), 500
+            elif game_state.winnings_cents > 0:
+                # Add winnings to guest bankroll
+                session['guest_bankroll_cents'] = session.get('guest_bankroll_cents', STARTING_BANKROLL_CENTS) + game_state.winnings_cents
         
-        return jsonify({
-            'success': True,
-            'correct': is_correct,
-            'card': str(card),
-            'card_rank': card.rank.name,
-            'card_suit': card.suit.value,
-            'card_color': card.color.value,
-            'winnings': winnings,
-            'status': game_state.status.value,
-            'round': game_state.current_round.value if game_state.status.value == 'active' else None
-        })
+        return jsonify(GuessResponse(
+            success=True,
+            correct=is_correct,
+            card=str(card),
+            card_rank=card.rank.name,
+            card_suit=card.suit.value,
+            card_color=card.color.value,
+            winnings=from_cents(winnings),
+            status=game_state.status.value,
+            round=game_state.current_round.value if game_state.status is GameStatus.ACTIVE else None
+        ))
     
     except Exception as e:
         return jsonify({'error': str(e)}), 400
 
 
 @app.route('/cash_out', methods=['POST'])
+@with_game_lock
 def cash_out():
     """Cash out current winnings - accessible to guests and users."""
     user, is_guest = get_current_user_or_guest()
     game_id = session.get('game_id')
     
-    if not game_id or game_id not in active_games:
+    if not game_id:
         return jsonify({'error': 'No active game'}), 400
     
-    game_state = active_games[game_id]
-    engine = CasinoRideTheBus()
+    game_state = game_store.get(game_id)
+    if game_state is None:
+        return jsonify({'error': 'Game expired, please start a new game'}), 400
     
     try:
         winnings = engine.cash_out(game_state)
+        game_store.set(game_id, game_state)
         
-        # Record the game for registered users only
+        # Record the game and credit winnings for registered users in one transaction
         if not is_guest:
-            user_manager.record_game(
+            if not user_manager.finalize_game(
                 user_id=user['id'],
                 game_id=game_state.game_id,
-                bet_amount=game_state.bet_amount,
-                final_winnings=winnings,
+                bet_cents=game_state.bet_cents,
+                winnings_cents=winnings,
                 rounds_completed=len(game_state.cards_drawn),
-                result='cashed_out'
-            )
-        
-        # Add winnings to bankroll
-        if is_guest:
-            session['guest_bankroll'] = session.get('guest_bankroll', 1000.0) + winnings
+                result='cashed_out',
+                bankroll_delta_cents=winnings,
+                cards_drawn=[card.code for card in game_state.cards_drawn]
+            ):
+                return jsonify({'error': 'Could not record game'}), 500
         else:
-            current_user = user_manager.get_user_by_id(user['id'])
-            user_manager.update_bankroll(user['id'], current_user['bankroll'] + winnings)
+            session['guest_bankroll_cents'] = session.get('guest_bankroll_cents', STARTING_BANKROLL_CENTS) + winnings
         
-        return jsonify({
-            'success': True,
-            'winnings': winnings,
-            'status': game_state.status.value
-        })
+        return jsonify(CashOutResponse(
+            success=True,
+            winnings=from_cents(winnings),
+            status=game_state.status.value
+        ))
     except Exception as e:
         return jsonify({'error': str(e)}), 400
 
@@ -308,28 +459,22 @@ def cash_out():
 @app.route('/new_game', methods=['POST'])
 def new_game():
     """Start a fresh game (clear session) - accessible to guests and users."""
-    session.pop('game_id', None)
-    return redirect(url_for('landing'))
+    game_id = session.pop('game_id', None)
+    if game_id:
+        game_store.delete(game_id)
+    return redirect(static_url_for('landing'))
 
 
 @app.route('/strategy')
 def get_strategy():
     """Get strategy recommendation for current game state - accessible to guests and users."""
-    game_id = session.get('game_id')
-    if not game_id or game_id not in active_games:
+    game_state = game_store.get(session.get('game_id', ''))
+    if game_state is None:
         return jsonify({'error': 'No active game'}), 400
     
-    game_state = active_games[game_id]
-    engine = CasinoRideTheBus()
-    strategy = engine.get_strategy_recommendation(game_state)
-    
-    return jsonify({
-        'action': strategy.action,
-        'confidence': strategy.confidence,
-        'reasoning': strategy.reasoning,
-        'expected_value': strategy.expected_value,
-        'probability': strategy.probability
-    })
+    # StrategyRecommendation is a dataclass with exactly the response fields;
+    # orjson (or Flask's default provider) encodes it without an interim dict
+    return jsonify(engine.get_strategy_recommendation(game_state))
 
 
 @app.route('/play_as_guest', methods=['POST'])
@@ -341,10 +486,10 @@ def play_as_guest():
     
     # Initialize guest session
     session['guest_id'] = str(uuid.uuid4())
-    session['guest_bankroll'] = 1000.0
+    session['guest_bankroll_cents'] = STARTING_BANKROLL_CENTS
     
     flash('Playing as guest! You start with $1000. Register to save your progress.', 'info')
-    return redirect(url_for('landing'))
+    return redirect(static_url_for('landing'))
 
 
 @app.route('/add_funds', methods=['POST'])
@@ -352,16 +497,15 @@ def play_as_guest():
 def add_funds():
     """Add funds to user account (demo purposes) - only for registered users."""
     user = get_current_user()
-    amount = float(request.form.get('amount', 0))
+    amount_cents = to_cents(request.form.get('amount', 0))
     
-    if amount > 0 and amount <= 1000:  # Limit for demo
-        current_user = user_manager.get_user_by_id(user['id'])
-        user_manager.update_bankroll(user['id'], current_user['bankroll'] + amount)
-        flash(f'Added ${amount:.2f} to your account!', 'success')
+    if amount_cents > 0 and amount_cents <= 100_000:  # Limit for demo ($1000)
+        user_manager.adjust_bankroll(user['id'], amount_cents)
+        flash(f'Added ${format_cents(amount_cents)} to your account!', 'success')
     else:
         flash('Invalid amount. Maximum $1000 per transaction.', 'error')
     
-    return redirect(url_for('landing'))
+    return redirect(static_url_for('landing'))
 
 
 if __name__ == '__main__':
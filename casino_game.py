@@ -1,11 +1,13 @@
 """
 Casino Ride the Bus - Core game types and logic
 """
-from enum import Enum
-from typing import List, Dict, Optional, Tuple
-from dataclasses import dataclass
+from enum import Enum, IntEnum
+from typing import List, NamedTuple, Optional, Tuple
+from dataclasses import dataclass, field
+from itertools import count
+import random
+import time
 import uuid
-from datetime import datetime
 
 
 class Suit(Enum):
@@ -36,13 +38,26 @@ class Color(Enum):
     BLACK = "black"
 
 
-class Round(Enum):
+class Round(IntEnum):
     ROUND1 = 1  # Red or Black
     ROUND2 = 2  # Higher/Lower
     ROUND3 = 3  # Inside/Outside
     ROUND4 = 4  # Suit guess
 
 
+class Guess(IntEnum):
+    RED = 0
+    BLACK = 1
+    HIGHER = 2
+    LOWER = 3
+    INSIDE = 4
+    OUTSIDE = 5
+    HEARTS = 6
+    DIAMONDS = 7
+    CLUBS = 8
+    SPADES = 9
+
+
 class GameStatus(Enum):
     ACTIVE = "active"
     WON = "won"
@@ -50,55 +65,135 @@ class GameStatus(Enum):
     CASHED_OUT = "cashed_out"
 
 
-@dataclass
+_SUITS = tuple(Suit)
+_SUIT_COLORS = {
+    Suit.HEARTS: Color.RED,
+    Suit.DIAMONDS: Color.RED,
+    Suit.CLUBS: Color.BLACK,
+    Suit.SPADES: Color.BLACK,
+}
+
+# Guess strings are parsed once in make_guess(); the round checks compare members
+_GUESSES = {guess.name.lower(): guess for guess in Guess}
+_GUESS_SUITS = {
+    Guess.HEARTS: Suit.HEARTS,
+    Guess.DIAMONDS: Suit.DIAMONDS,
+    Guess.CLUBS: Suit.CLUBS,
+    Guess.SPADES: Suit.SPADES,
+}
+
+# Payout multiplier indexed by round number (whole numbers keep cents exact)
+_MULTIPLIERS = (
+    1,  # unused: rounds start at 1
+    2,  # Round 1: double your bet
+    2,  # Round 2: double current winnings
+    3,  # Round 3: triple current winnings
+    4,  # Round 4: quadruple current winnings
+)
+
+
+@dataclass(frozen=True, slots=True)
 class Card:
     rank: Rank
     suit: Suit
+    # Derived once at construction; cards are immutable and shared across decks
+    code: int = field(init=False, repr=False, compare=False)
+    _label: str = field(init=False, repr=False, compare=False)
+    
+    def __post_init__(self):
+        # Compact integer encoding (0-51) used when serializing game state
+        object.__setattr__(self, "code", _SUITS.index(self.suit) * 13 + (self.rank.value - 2))
+        object.__setattr__(self, "_label", f"{self.rank.name}{self.suit.value}")
     
     @property
     def color(self) -> Color:
-        return Color.RED if self.suit in [Suit.HEARTS, Suit.DIAMONDS] else Color.BLACK
+        return _SUIT_COLORS[self.suit]
     
     @property
     def value(self) -> int:
         return self.rank.value
     
+    @classmethod
+    def from_code(cls, code: int) -> "Card":
+        return _FULL_DECK[code]
+    
     def __str__(self):
-        return f"{self.rank.name}{self.suit.value}"
+        return self._label
 
 
-@dataclass
+# Cards are immutable, so every deck shares these 52 instances (index == Card.code)
+_FULL_DECK = tuple(Card(rank, suit) for suit in Suit for rank in Rank)
+
+
+class Move(NamedTuple):
+    """One entry in a game's history"""
+    round: int
+    guess: str
+    card: Card
+    correct: bool
+    winnings: int  # cents held after the move
+    timestamp: int  # time.time_ns()
+
+
+@dataclass(slots=True)
 class GameState:
     game_id: str
     current_round: Round
     cards_drawn: List[Card]
-    bet_amount: float
-    current_winnings: float
+    bet_cents: int
+    winnings_cents: int
     status: GameStatus
     deck: List[Card]
-    game_history: List[Dict]
+    game_history: List[Move]
     
     @property
-    def potential_winnings(self) -> float:
-        """Calculate potential winnings if current round is won"""
-        multiplier = self.get_round_multiplier(self.current_round)
-        if self.current_round == Round.ROUND1:
-            return self.bet_amount * multiplier
-        else:
-            return self.current_winnings * multiplier
+    def potential_winnings_cents(self) -> int:
+        """Calculate potential winnings (in cents) if current round is won"""
+        base = self.bet_cents if self.current_round is Round.ROUND1 else self.winnings_cents
+        return base * _MULTIPLIERS[self.current_round]
+    
+    def to_compact_tuple(self) -> tuple:
+        """Flatten the game into plain ints/strs for external storage"""
+        return (
+            self.game_id,
+            self.current_round.value,
+            self.status.value,
+            self.bet_cents,
+            self.winnings_cents,
+            [card.code for card in self.cards_drawn],
+            [card.code for card in self.deck],
+            # The card of move i is cards_drawn[i], so it is not stored twice
+            [
+                (move.round, move.guess, move.correct, move.winnings, move.timestamp)
+                for move in self.game_history
+            ],
+        )
     
-    def get_round_multiplier(self, round_num: Round) -> float:
+    @classmethod
+    def from_compact_tuple(cls, data) -> "GameState":
+        """Rebuild a game from to_compact_tuple() output"""
+        game_id, round_value, status, bet_cents, winnings_cents, drawn, deck, history = data
+        cards_drawn = [Card.from_code(code) for code in drawn]
+        return cls(
+            game_id=game_id,
+            current_round=Round(round_value),
+            cards_drawn=cards_drawn,
+            bet_cents=bet_cents,
+            winnings_cents=winnings_cents,
+            status=GameStatus(status),
+            deck=[Card.from_code(code) for code in deck],
+            game_history=[
+                Move(move[0], move[1], card, move[2], move[3], move[4])
+                for move, card in zip(history, cards_drawn)
+            ]
+        )
+    
+    def get_round_multiplier(self, round_num: Round) -> int:
         """Get the payout multiplier for each round"""
-        multipliers = {
-            Round.ROUND1: 2.0,  # Double your bet
-            Round.ROUND2: 2.0,  # Double current winnings
-            Round.ROUND3: 3.0,  # Triple current winnings
-            Round.ROUND4: 4.0,  # Quadruple current winnings
-        }
-        return multipliers.get(round_num, 1.0)
+        return _MULTIPLIERS[round_num]
 
 
-@dataclass
+@dataclass(frozen=True, slots=True)
 class StrategyRecommendation:
     action: str  # "pick_red", "pick_black", "pick_higher", "pick_lower", "pick_inside", "pick_outside", "cash_out", "forfeit"
     confidence: float  # 0.0 to 1.0
@@ -107,32 +202,157 @@ class StrategyRecommendation:
     probability: float
 
 
+# Strategy depends only on the round and the ranks already drawn, so every
+# possible (frozen) recommendation is built once below and looked up by rank.
+def _build_round1_strategy() -> StrategyRecommendation:
+    """Round 1 strategy: Pick either color consistently"""
+    return StrategyRecommendation(
+        action="pick_red",
+        confidence=0.5,
+        reasoning="50/50 chance. Pick red consistently for pattern.",
+        expected_value=1.0,  # Even odds
+        probability=0.5
+    )
+
+
+def _build_round2_strategy(value: int) -> StrategyRecommendation:
+    """Round 2 strategy based on first card value"""
+    if 2 <= value <= 5:
+        # Low cards: pick higher
+        prob = (14 - value) / 12  # Cards higher than first card / remaining cards
+        return StrategyRecommendation(
+            action="pick_higher",
+            confidence=0.8,
+            reasoning=f"Card {value} is low. {prob:.1%} chance of higher card.",
+            expected_value=prob * 2.0,
+            probability=prob
+        )
+    elif 6 <= value <= 10:
+        # Middle cards: forfeit (too risky)
+        return StrategyRecommendation(
+            action="cash_out",
+            confidence=0.9,
+            reasoning=f"Card {value} is in danger zone. Cash out to preserve winnings.",
+            expected_value=1.0,  # Keep current winnings
+            probability=1.0
+        )
+    else:
+        # High cards (J, Q, K, A): pick lower
+        prob = (value - 2) / 12  # Cards lower than first card / remaining cards
+        return StrategyRecommendation(
+            action="pick_lower",
+            confidence=0.8,
+            reasoning=f"Card {value} is high. {prob:.1%} chance of lower card.",
+            expected_value=prob * 2.0,
+            probability=prob
+        )
+
+
+def _build_round3_strategy(low: int, high: int) -> StrategyRecommendation:
+    """Round 3 strategy based on the gap between the low and high card"""
+    gap = high - low
+    
+    if gap == 0:  # Pair
+        return StrategyRecommendation(
+            action="pick_outside",
+            confidence=0.95,
+            reasoning="Pair of cards. Very high chance of outside.",
+            expected_value=2.7,
+            probability=0.9
+        )
+    elif gap == 1:  # Connecting cards
+        return StrategyRecommendation(
+            action="pick_outside",
+            confidence=0.95,
+            reasoning="Connecting cards (no gap). Very high chance of outside.",
+            expected_value=2.7,
+            probability=0.9
+        )
+    elif gap == 2:  # 1-card gap
+        return StrategyRecommendation(
+            action="pick_outside",
+            confidence=0.85,
+            reasoning="1-card gap. High chance of outside.",
+            expected_value=2.4,
+            probability=0.8
+        )
+    elif gap >= 9:  # 9+ card gap
+        inside_prob = (gap - 1) / 12
+        return StrategyRecommendation(
+            action="pick_inside",
+            confidence=0.8,
+            reasoning=f"{gap}-card gap. {inside_prob:.1%} chance of inside.",
+            expected_value=inside_prob * 3.0,
+            probability=inside_prob
+        )
+    else:  # 2-8 card gap
+        return StrategyRecommendation(
+            action="cash_out",
+            confidence=0.9,
+            reasoning=f"{gap}-card gap is in danger zone. Cash out recommended.",
+            expected_value=2.0,  # Keep current winnings
+            probability=1.0
+        )
+
+
+def _build_round4_strategy() -> StrategyRecommendation:
+    """Round 4 strategy: pick any suit (25% chance each)"""
+    # All 4 suits are available to choose from
+    prob = 1.0 / 4  # 25% chance
+    
+    # Recommend hearts as default (could be any suit)
+    return StrategyRecommendation(
+        action="pick_hearts",
+        confidence=0.6,
+        reasoning="Pick any suit. Each has a 25% chance of being correct.",
+        expected_value=prob * 4.0,
+        probability=prob
+    )
+
+
+_ROUND1_STRATEGY = _build_round1_strategy()
+# Indexed by first rank - 2
+_ROUND2_STRATEGIES = tuple(_build_round2_strategy(value) for value in range(2, 15))
+# Indexed by (first rank - 2) * 13 + (second rank - 2), in either card order
+_ROUND3_STRATEGIES = tuple(
+    _build_round3_strategy(min(a, b), max(a, b)) for a in range(2, 15) for b in range(2, 15)
+)
+_ROUND4_STRATEGY = _build_round4_strategy()
+
+
 class CasinoRideTheBus:
     """Main game engine for Casino Ride the Bus"""
     
-    def __init__(self, seed: Optional[int] = None):
-        import random
-        if seed:
-            random.seed(seed)
-        self.rng = random
+    def __init__(self, seed: Optional[int] = None, record_history: bool = True):
+        # A private generator: seeding one engine (including seed=0) never touches another
+        self.rng = random.Random(seed)
+        self.seed = seed
+        self.record_history = record_history  # batch runs can skip the per-move log
+        self._game_counter = count()
+        # Round checks indexed by round number; each takes (guess, card, cards_drawn)
+        self._round_checks = (None, self._check_round1, self._check_round2,
+                              self._check_round3, self._check_round4)
+    
+    def _new_game_id(self) -> str:
+        """Seeded engines number their games; live ones need globally unique ids"""
+        if self.seed is None:
+            return str(uuid.uuid4())
+        return f"{self.seed}-{next(self._game_counter)}"
     
     def create_deck(self) -> List[Card]:
         """Create a standard 52-card deck"""
-        deck = []
-        for suit in Suit:
-            for rank in Rank:
-                deck.append(Card(rank, suit))
+        deck = list(_FULL_DECK)
         self.rng.shuffle(deck)
         return deck
     
-    def start_new_game(self, bet_amount: float) -> GameState:
-        """Start a new game with the given bet amount"""
+    def start_new_game(self, bet_cents: int) -> GameState:
+        """Start a new game with the given bet (in cents)"""
         return GameState(
-            game_id=str(uuid.uuid4()),
+            game_id=self._new_game_id(),
             current_round=Round.ROUND1,
             cards_drawn=[],
-            bet_amount=bet_amount,
-            current_winnings=0.0,
+            bet_cents=bet_cents,
+            winnings_cents=0,
             status=GameStatus.ACTIVE,
             deck=self.create_deck(),
             game_history=[]
@@ -142,218 +362,118 @@ class CasinoRideTheBus:
         """Draw the next card from the deck"""
         if not game.deck:
             raise ValueError("Deck is empty")
-        card = game.deck.pop(0)
+        card = game.deck.pop()  # top of the deck is the end of the list
         game.cards_drawn.append(card)
         return card
     
-    def make_guess(self, game: GameState, guess: str) -> Tuple[bool, Card, float]:
+    def make_guess(self, game: GameState, guess: str) -> Tuple[bool, Card, int]:
         """
         Make a guess for the current round
-        Returns: (is_correct, card_drawn, winnings)
+        Returns: (is_correct, card_drawn, winnings_cents)
         """
-        if game.status != GameStatus.ACTIVE:
+        if game.status is not GameStatus.ACTIVE:
             raise ValueError("Game is not active")
         
+        guess = guess.lower()
+        guess_code = _GUESSES.get(guess)
+        if guess_code is None:
+            raise ValueError(f"Unknown guess: {guess}")
+        
         card = self.draw_card(game)
-        is_correct = self._check_guess(game, guess, card)
+        is_correct = self._check_guess(game, guess_code, card)
         
         if is_correct:
             # Win the round
-            if game.current_round == Round.ROUND1:
-                game.current_winnings = game.bet_amount * game.get_round_multiplier(game.current_round)
-            else:
-                game.current_winnings *= game.get_round_multiplier(game.current_round)
+            game.winnings_cents = game.potential_winnings_cents
             
             # Move to next round or win the game
-            if game.current_round == Round.ROUND4:
+            if game.current_round is Round.ROUND4:
                 game.status = GameStatus.WON
             else:
-                game.current_round = Round(game.current_round.value + 1)
+                game.current_round = Round(game.current_round + 1)
         else:
             # Lose the game
             game.status = GameStatus.LOST
-            game.current_winnings = 0.0
+            game.winnings_cents = 0
         
-        # Record the move
-        game.game_history.append({
-            "round": game.current_round.value,
-            "guess": guess,
-            "card": str(card),
-            "correct": is_correct,
-            "winnings": game.current_winnings,
-            "timestamp": datetime.now().isoformat()
-        })
+        # Record the move (the card is formatted and the timestamp read only where shown)
+        if self.record_history:
+            game.game_history.append(Move(
+                game.current_round.value, guess, card, is_correct,
+                game.winnings_cents, time.time_ns()
+            ))
         
-        return is_correct, card, game.current_winnings
+        return is_correct, card, game.winnings_cents
     
-    def cash_out(self, game: GameState) -> float:
-        """Cash out current winnings"""
-        if game.status != GameStatus.ACTIVE or game.current_round == Round.ROUND1:
+    def cash_out(self, game: GameState) -> int:
+        """Cash out current winnings (returned in cents)"""
+        if game.status is not GameStatus.ACTIVE or game.current_round is Round.ROUND1:
             raise ValueError("Cannot cash out at this time")
         
-        winnings = game.current_winnings
+        winnings = game.winnings_cents
         game.status = GameStatus.CASHED_OUT
         return winnings
     
-    def _check_guess(self, game: GameState, guess: str, card: Card) -> bool:
+    def _check_guess(self, game: GameState, guess: Guess, card: Card) -> bool:
         """Check if the guess is correct for the current round"""
-        if game.current_round == Round.ROUND1:
-            return self._check_round1(guess, card)
-        elif game.current_round == Round.ROUND2:
-            return self._check_round2(guess, card, game.cards_drawn[0])
-        elif game.current_round == Round.ROUND3:
-            return self._check_round3(guess, card, game.cards_drawn[0], game.cards_drawn[1])
-        elif game.current_round == Round.ROUND4:
-            return self._check_round4(guess, card, game.cards_drawn)
-        return False
+        return self._round_checks[game.current_round](guess, card, game.cards_drawn)
     
-    def _check_round1(self, guess: str, card: Card) -> bool:
+    def _check_round1(self, guess: Guess, card: Card, drawn: List[Card]) -> bool:
         """Round 1: Red or Black"""
-        return (guess.lower() == "red" and card.color == Color.RED) or \
-               (guess.lower() == "black" and card.color == Color.BLACK)
+        return (guess is Guess.RED and card.color is Color.RED) or \
+               (guess is Guess.BLACK and card.color is Color.BLACK)
     
-    def _check_round2(self, guess: str, card: Card, first_card: Card) -> bool:
+    def _check_round2(self, guess: Guess, card: Card, drawn: List[Card]) -> bool:
         """Round 2: Higher/Equal or Lower"""
-        if guess.lower() == "higher":
+        first_card = drawn[0]
+        if guess is Guess.HIGHER:
             return card.value >= first_card.value
-        elif guess.lower() == "lower":
+        elif guess is Guess.LOWER:
             return card.value <= first_card.value
         return False
     
-    def _check_round3(self, guess: str, card: Card, first_card: Card, second_card: Card) -> bool:
+    def _check_round3(self, guess: Guess, card: Card, drawn: List[Card]) -> bool:
         """Round 3: Inside or Outside the range"""
-        low = min(first_card.value, second_card.value)
-        high = max(first_card.value, second_card.value)
+        a, b = drawn[0].rank.value, drawn[1].rank.value
+        low, high = (a, b) if a <= b else (b, a)
         
-        if guess.lower() == "inside":
-            return low < card.value < high
-        elif guess.lower() == "outside":
-            return card.value <= low or card.value >= high
+        value = card.rank.value
+        if guess is Guess.INSIDE:
+            return low < value < high
+        elif guess is Guess.OUTSIDE:
+            return value <= low or value >= high
         return False
     
-    def _check_round4(self, guess: str, card: Card, previous_cards: List[Card]) -> bool:
+    def _check_round4(self, guess: Guess, card: Card, drawn: List[Card]) -> bool:
         """Round 4: Guess the suit - can choose from any of the 4 suits"""
-        # Check if guessed suit matches the card
-        guessed_suit = guess.lower()
-        card_suit = card.suit.name.lower()
-        
-        return guessed_suit == card_suit
+        # Check if guessed suit matches the card (non-suit guesses map to None)
+        return _GUESS_SUITS.get(guess) is card.suit
     
     def get_strategy_recommendation(self, game: GameState) -> StrategyRecommendation:
         """Get optimal strategy recommendation based on current game state"""
-        if game.current_round == Round.ROUND1:
+        if game.current_round is Round.ROUND1:
             return self._strategy_round1()
-        elif game.current_round == Round.ROUND2:
+        elif game.current_round is Round.ROUND2:
             return self._strategy_round2(game.cards_drawn[0])
-        elif game.current_round == Round.ROUND3:
+        elif game.current_round is Round.ROUND3:
             return self._strategy_round3(game.cards_drawn[0], game.cards_drawn[1])
-        elif game.current_round == Round.ROUND4:
+        elif game.current_round is Round.ROUND4:
             return self._strategy_round4(game.cards_drawn[:3])
         
         return StrategyRecommendation("cash_out", 0.0, "Unknown round", 0.0, 0.0)
     
     def _strategy_round1(self) -> StrategyRecommendation:
         """Round 1 strategy: Pick either color consistently"""
-        return StrategyRecommendation(
-            action="pick_red",
-            confidence=0.5,
-            reasoning="50/50 chance. Pick red consistently for pattern.",
-            expected_value=1.0,  # Even odds
-            probability=0.5
-        )
+        return _ROUND1_STRATEGY
     
     def _strategy_round2(self, first_card: Card) -> StrategyRecommendation:
         """Round 2 strategy based on first card value"""
-        value = first_card.value
-        
-        if 2 <= value <= 5:
-            # Low cards: pick higher
-            prob = (14 - value) / 12  # Cards higher than first card / remaining cards
-            return StrategyRecommendation(
-                action="pick_higher",
-                confidence=0.8,
-                reasoning=f"Card {value} is low. {prob:.1%} chance of higher card.",
-                expected_value=prob * 2.0,
-                probability=prob
-            )
-        elif 6 <= value <= 10:
-            # Middle cards: forfeit (too risky)
-            return StrategyRecommendation(
-                action="cash_out",
-                confidence=0.9,
-                reasoning=f"Card {value} is in danger zone. Cash out to preserve winnings.",
-                expected_value=1.0,  # Keep current winnings
-                probability=1.0
-            )
-        else:
-            # High cards (J, Q, K, A): pick lower
-            prob = (value - 2) / 12  # Cards lower than first card / remaining cards
-            return StrategyRecommendation(
-                action="pick_lower",
-                confidence=0.8,
-                reasoning=f"Card {value} is high. {prob:.1%} chance of lower card.",
-                expected_value=prob * 2.0,
-                probability=prob
-            )
+        return _ROUND2_STRATEGIES[first_card.rank.value - 2]
     
     def _strategy_round3(self, first_card: Card, second_card: Card) -> StrategyRecommendation:
         """Round 3 strategy based on card gap"""
-        low = min(first_card.value, second_card.value)
-        high = max(first_card.value, second_card.value)
-        gap = high - low
-        
-        if gap == 0:  # Pair
-            return StrategyRecommendation(
-                action="pick_outside",
-                confidence=0.95,
-                reasoning="Pair of cards. Very high chance of outside.",
-                expected_value=2.7,
-                probability=0.9
-            )
-        elif gap == 1:  # Connecting cards
-            return StrategyRecommendation(
-                action="pick_outside",
-                confidence=0.95,
-                reasoning="Connecting cards (no gap). Very high chance of outside.",
-                expected_value=2.7,
-                probability=0.9
-            )
-        elif gap == 2:  # 1-card gap
-            return StrategyRecommendation(
-                action="pick_outside",
-                confidence=0.85,
-                reasoning="1-card gap. High chance of outside.",
-                expected_value=2.4,
-                probability=0.8
-            )
-        elif gap >= 9:  # 9+ card gap
-            inside_prob = (gap - 1) / 12
-            return StrategyRecommendation(
-                action="pick_inside",
-                confidence=0.8,
-                reasoning=f"{gap}-card gap. {inside_prob:.1%} chance of inside.",
-                expected_value=inside_prob * 3.0,
-                probability=inside_prob
-            )
-        else:  # 2-8 card gap
-            return StrategyRecommendation(
-                action="cash_out",
-                confidence=0.9,
-                reasoning=f"{gap}-card gap is in danger zone. Cash out recommended.",
-                expected_value=2.0,  # Keep current winnings
-                probability=1.0
-            )
+        return _ROUND3_STRATEGIES[(first_card.rank.value - 2) * 13 + second_card.rank.value - 2]
     
     def _strategy_round4(self, previous_cards: List[Card]) -> StrategyRecommendation:
         """Round 4 strategy: pick any suit (25% chance each)"""
-        # All 4 suits are available to choose from
-        prob = 1.0 / 4  # 25% chance
-        
-        # Recommend hearts as default (could be any suit)
-        return StrategyRecommendation(
-            action="pick_hearts",
-            confidence=0.6,
-            reasoning="Pick any suit. Each has a 25% chance of being correct.",
-            expected_value=prob * 4.0,
-            probability=prob
-        )
\ No newline at end of file
+        return _ROUND4_STRATEGY
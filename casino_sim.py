@@ -0,0 +1,77 @@
+"""
+Casino Ride the Bus - Batch game simulator
+Plays many games on integer card codes to study strategy returns without the web engine
+"""
+import random
+from typing import List, Optional
+
+from casino_game import _ROUND2_STRATEGIES, _ROUND3_STRATEGIES
+
+# Card codes match Card.code: suit index * 13 + (rank - 2), suits in Suit order
+_DECK_CODES = range(52)
+
+# The advisor's actions as small ints, indexed like the engine's strategy tables
+# (by rank - 2, i.e. code % 13), so the game loop never touches a recommendation object
+_CASH_OUT, _HIGHER, _LOWER, _INSIDE, _OUTSIDE = range(5)
+_ACTION_CODES = {
+    "cash_out": _CASH_OUT,
+    "pick_higher": _HIGHER,
+    "pick_lower": _LOWER,
+    "pick_inside": _INSIDE,
+    "pick_outside": _OUTSIDE,
+}
+_ROUND2_ACTIONS = tuple(_ACTION_CODES[rec.action] for rec in _ROUND2_STRATEGIES)
+_ROUND3_ACTIONS = tuple(_ACTION_CODES[rec.action] for rec in _ROUND3_STRATEGIES)
+
+
+def simulate_batch(n_games: int, bet_cents: int = 1000, seed: Optional[int] = None) -> List[int]:
+    """Play n_games following the engine's strategy recommendations.
+    Returns each game's payout in cents (0 for a lost game)."""
+    rng = random.Random(seed)
+    sample = rng.sample
+    payouts = []
+    append = payouts.append
+
+    for _ in range(n_games):
+        # Only the top four cards of a shuffled deck are ever seen
+        c1, c2, c3, c4 = sample(_DECK_CODES, 4)
+
+        # Round 1: the strategy always picks red (hearts and diamonds are suits 0 and 1)
+        if c1 >= 26:
+            append(0)
+            continue
+        winnings = bet_cents * 2
+
+        # Round 2: higher/equal or lower/equal than the first card
+        first, second = c1 % 13, c2 % 13  # rank - 2 orders the same as rank
+        action = _ROUND2_ACTIONS[first]
+        if action == _CASH_OUT:
+            append(winnings)
+            continue
+        if not (second >= first if action == _HIGHER else second <= first):
+            append(0)
+            continue
+        winnings *= 2
+
+        # Round 3: inside or outside the first two cards
+        action = _ROUND3_ACTIONS[first * 13 + second]
+        if action == _CASH_OUT:
+            append(winnings)
+            continue
+        low, high = (first, second) if first <= second else (second, first)
+        third = c3 % 13
+        if not (low < third < high if action == _INSIDE else third <= low or third >= high):
+            append(0)
+            continue
+        winnings *= 3
+
+        # Round 4: the strategy picks hearts (suit 0)
+        append(winnings * 4 if c4 < 13 else 0)
+
+    return payouts
+
+
+if __name__ == "__main__":
+    games = 100_000
+    payouts = simulate_batch(games, bet_cents=1000, seed=42)
+    print(f"Return to player over {games} games: {sum(payouts) / (games * 1000):.2%}")
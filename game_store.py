@@ -0,0 +1,163 @@
+"""
+Game storage backends for Casino Ride the Bus
+Keeps in-flight GameState objects either in process memory or in Redis
+"""
+import json
+import os
+import secrets
+import threading
+from typing import Optional, Protocol
+
+from casino_game import GameState
+from ttl_cache import TTLCache
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import redis
+except ImportError:  # Redis is only needed for multi-worker deployments
+    redis = None
+
+
+DEFAULT_GAME_TTL = 1800  # seconds a game may sit idle before it is discarded
+MOVE_LOCK_TIMEOUT = 10  # seconds before a crashed request's Redis move lock lapses
+
+# Delete the lock only while it still holds our token; after a lapse it may be another request's
+_RELEASE_LOCK_SCRIPT = """
+if redis.call('get', KEYS[1]) == ARGV[1] then
+    return redis.call('del', KEYS[1])
+end
+return 0
+"""
+
+
+class GameStore(Protocol):
+    """Interface shared by all game storage backends"""
+
+    def get(self, game_id: str) -> Optional[GameState]:
+        ...
+
+    def set(self, game_id: str, game: GameState) -> None:
+        ...
+
+    def delete(self, game_id: str) -> None:
+        ...
+
+    def expire(self) -> None:
+        ...
+
+    def acquire(self, game_id: str) -> Optional[str]:
+        """Try to take the game's move lock without blocking; returns a token for release()"""
+        ...
+
+    def release(self, game_id: str, token: str) -> None:
+        """Give up the move lock, but only if token still holds it"""
+        ...
+
+
+class InMemoryGameStore:
+    """Per-process store; fine for development and single-worker servers"""
+
+    def __init__(self, maxsize: int = 10000, ttl: float = DEFAULT_GAME_TTL):
+        # Each entry is [GameState, lock holder's token or None] so the lock lives and
+        # expires with its game
+        self._games = TTLCache(maxsize=maxsize, ttl=ttl)
+        self._guard = threading.Lock()
+
+    def get(self, game_id: str) -> Optional[GameState]:
+        entry = self._games.get(game_id)
+        return entry[0] if entry is not None else None
+
+    def set(self, game_id: str, game: GameState) -> None:
+        with self._guard:
+            entry = self._games.get(game_id)
+            if entry is None:
+                self._games[game_id] = [game, None]
+            else:
+                entry[0] = game
+
+    def delete(self, game_id: str) -> None:
+        self._games.pop(game_id)
+
+    def expire(self) -> None:
+        self._games.expire()
+
+    def acquire(self, game_id: str) -> Optional[str]:
+        token = secrets.token_hex(16)
+        with self._guard:
+            entry = self._games.get(game_id)
+            if entry is None:
+                return token  # no game to guard; the route reports it missing
+            if entry[1] is not None:
+                return None
+            entry[1] = token
+        return token
+
+    def release(self, game_id: str, token: str) -> None:
+        with self._guard:
+            entry = self._games.get(game_id)
+            if entry is not None and entry[1] == token:
+                entry[1] = None
+
+
+class RedisGameStore:
+    """Shared store so any worker can serve any game; Redis handles expiry"""
+
+    def __init__(self, url: str, ttl: int = DEFAULT_GAME_TTL, prefix: str = "game:"):
+        if redis is None:
+            raise RuntimeError("RedisGameStore requires the 'redis' package")
+        self._redis = redis.Redis.from_url(url)
+        self.ttl = ttl
+        self.prefix = prefix
+        self._release_lock = self._redis.register_script(_RELEASE_LOCK_SCRIPT)
+
+    def get(self, game_id: str) -> Optional[GameState]:
+        key = self.prefix + game_id
+        data = self._redis.get(key)
+        if data is None:
+            return None
+        # Reading a game counts as activity, same as the in-memory store
+        self._redis.expire(key, self.ttl)
+        return GameState.from_compact_tuple(_loads(data))
+
+    def set(self, game_id: str, game: GameState) -> None:
+        self._redis.setex(self.prefix + game_id, self.ttl, _dumps(game.to_compact_tuple()))
+
+    def delete(self, game_id: str) -> None:
+        self._redis.delete(self.prefix + game_id)
+
+    def expire(self) -> None:
+        pass
+
+    def acquire(self, game_id: str) -> Optional[str]:
+        token = secrets.token_hex(16)
+        if self._redis.set(self.prefix + game_id + ":lock", token, nx=True, px=MOVE_LOCK_TIMEOUT * 1000):
+            return token
+        return None
+
+    def release(self, game_id: str, token: str) -> None:
+        self._release_lock(keys=[self.prefix + game_id + ":lock"], args=[token])
+
+
+def _dumps(data) -> bytes:
+    if orjson is not None:
+        return orjson.dumps(data)
+    return json.dumps(data, separators=(",", ":")).encode()
+
+
+def _loads(data: bytes):
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+def create_game_store() -> GameStore:
+    """Pick a backend from the environment: Redis if REDIS_URL is set, else memory"""
+    ttl = int(os.getenv("ACTIVE_GAME_TTL", DEFAULT_GAME_TTL))
+    redis_url = os.getenv("REDIS_URL")
+    if redis_url:
+        return RedisGameStore(redis_url, ttl=ttl)
+    return InMemoryGameStore(maxsize=int(os.getenv("MAX_ACTIVE_GAMES", 10000)), ttl=ttl)
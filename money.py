@@ -0,0 +1,23 @@
+"""
+Money helpers for Casino Ride the Bus
+Amounts are kept as integer cents everywhere; dollars only appear at the display edge
+"""
+
+STARTING_BANKROLL_CENTS = 100_000  # $1000.00 for new accounts and guests
+
+
+def to_cents(amount) -> int:
+    """Convert a dollar amount (float, str or int) to integer cents"""
+    return int(round(float(amount) * 100))
+
+
+def from_cents(cents: int) -> float:
+    """Convert integer cents back to dollars (for JSON responses)"""
+    return cents / 100
+
+
+def format_cents(cents: int) -> str:
+    """Format integer cents as a dollar string without the '$', e.g. 1050 -> '10.50'"""
+    sign = "-" if cents < 0 else ""
+    dollars, cents = divmod(abs(int(cents)), 100)
+    return f"{sign}{dollars}.{cents:02d}"
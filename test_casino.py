@@ -3,9 +3,20 @@ Test the casino Ride the Bus game engine
 """
 import sys
 import os
+import hashlib
+import tempfile
+import time
+import sqlite3
+import subprocess
+import threading
 sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
-from casino_game import CasinoRideTheBus, Round, GameStatus
+from casino_game import CasinoRideTheBus, GameState, Round, GameStatus
+from money import format_cents
+from casino_sim import simulate_batch
+from ttl_cache import TTLCache
+from game_store import InMemoryGameStore, RedisGameStore
+from user_manager import UserManager, SCHEMA_VERSION, PASSWORD_ITERATIONS
 
 def test_full_game():
     """Test a complete game scenario"""
@@ -15,8 +26,8 @@ def test_full_game():
     engine = CasinoRideTheBus(seed=42)
     
     # Start new game with $10 bet
-    game = engine.start_new_game(10.0)
-    print(f"Started game with ${game.bet_amount} bet")
+    game = engine.start_new_game(1000)
+    print(f"Started game with ${format_cents(game.bet_cents)} bet")
     print(f"Game ID: {game.game_id}")
     print(f"Current round: {game.current_round.value}")
     print()
@@ -32,7 +43,7 @@ def test_full_game():
     print(f"Guessed: RED")
     print(f"Card drawn: {card} ({card.color.value})")
     print(f"Result: {'✅ CORRECT' if is_correct else '❌ WRONG'}")
-    print(f"Winnings: ${winnings}")
+    print(f"Winnings: ${format_cents(winnings)}")
     print(f"Game status: {game.status.value}")
     print()
     
@@ -53,7 +64,7 @@ def test_full_game():
     print(f"Guessed: {guess.upper()}")
     print(f"Card drawn: {card} (value: {card.rank.value})")
     print(f"Result: {'✅ CORRECT' if is_correct else '❌ WRONG'}")
-    print(f"Winnings: ${winnings}")
+    print(f"Winnings: ${format_cents(winnings)}")
     print(f"Game status: {game.status.value}")
     print()
     
@@ -74,7 +85,7 @@ def test_full_game():
     if "cash_out" in strategy.action:
         print("🏦 Strategy recommends CASH OUT!")
         winnings = engine.cash_out(game)
-        print(f"Cashed out: ${winnings}")
+        print(f"Cashed out: ${format_cents(winnings)}")
         print(f"Game status: {game.status.value}")
         return
     
@@ -84,7 +95,7 @@ def test_full_game():
     print(f"Guessed: {guess.upper()}")
     print(f"Card drawn: {card} (value: {card.rank.value})")
     print(f"Result: {'✅ CORRECT' if is_correct else '❌ WRONG'}")
-    print(f"Winnings: ${winnings}")
+    print(f"Winnings: ${format_cents(winnings)}")
     print(f"Game status: {game.status.value}")
     print()
     
@@ -113,7 +124,7 @@ def test_full_game():
         print(f"Guessed: {guess_suit.upper()}")
         print(f"Card drawn: {card}")
         print(f"Result: {'✅ CORRECT' if is_correct else '❌ WRONG'}")
-        print(f"Final winnings: ${winnings}")
+        print(f"Final winnings: ${format_cents(winnings)}")
         print(f"Game status: {game.status.value}")
     else:
         print("❌ All suits used - should have cashed out!")
@@ -121,13 +132,13 @@ def test_full_game():
     print()
     print("=== GAME COMPLETE ===")
     if game.status.value == 'won':
-        profit = game.current_winnings - game.bet_amount
-        print(f"🎉 WON! Profit: ${profit}")
+        profit = game.winnings_cents - game.bet_cents
+        print(f"🎉 WON! Profit: ${format_cents(profit)}")
     elif game.status.value == 'lost':
-        print(f"💔 LOST! Lost: ${game.bet_amount}")
+        print(f"💔 LOST! Lost: ${format_cents(game.bet_cents)}")
     elif game.status.value == 'cashed_out':
-        profit = game.current_winnings - game.bet_amount
-        print(f"💰 CASHED OUT! Profit: ${profit}")
+        profit = game.winnings_cents - game.bet_cents
+        print(f"💰 CASHED OUT! Profit: ${format_cents(profit)}")
 
 
 def test_strategy_system():
@@ -144,16 +155,19 @@ def test_strategy_system():
     low_card = Card(Rank.THREE, Suit.HEARTS)  # Value 3
     strategy = engine._strategy_round2(low_card)
     print(f"Card 3: {strategy.action} (confidence: {strategy.confidence:.1%})")
+    assert strategy.action == "pick_higher"
     
     # Middle card (should cash out)
     mid_card = Card(Rank.EIGHT, Suit.CLUBS)  # Value 8
     strategy = engine._strategy_round2(mid_card)
     print(f"Card 8: {strategy.action} (confidence: {strategy.confidence:.1%})")
+    assert strategy.action == "cash_out"
     
     # High card (should pick lower)
     high_card = Card(Rank.KING, Suit.SPADES)  # Value 13
     strategy = engine._strategy_round2(high_card)
     print(f"Card K: {strategy.action} (confidence: {strategy.confidence:.1%})")
+    assert strategy.action == "pick_lower"
     
     print("\n=== Round 3 Strategy Tests ===")
     
@@ -162,6 +176,7 @@ def test_strategy_system():
     card2 = Card(Rank.SEVEN, Suit.CLUBS)
     strategy = engine._strategy_round3(card1, card2)
     print(f"Pair 7-7: {strategy.action} (confidence: {strategy.confidence:.1%})")
+    assert strategy.action == "pick_outside"
     
     # Large gap (should pick inside)
     card1 = Card(Rank.ACE, Suit.HEARTS)  # 14
@@ -169,6 +184,7 @@ def test_strategy_system():
     strategy = engine._strategy_round3(card1, card2)
     gap = abs(card1.rank.value - card2.rank.value)
     print(f"A-2 gap ({gap}): {strategy.action} (confidence: {strategy.confidence:.1%})")
+    assert strategy.action == "pick_inside"
     
     # Medium gap (should cash out)
     card1 = Card(Rank.TEN, Suit.HEARTS)  # 10
@@ -176,6 +192,7 @@ def test_strategy_system():
     strategy = engine._strategy_round3(card1, card2)
     gap = abs(card1.rank.value - card2.rank.value)
     print(f"10-5 gap ({gap}): {strategy.action} (confidence: {strategy.confidence:.1%})")
+    assert strategy.action == "cash_out"
 
 
 def test_statistical_accuracy():
@@ -188,9 +205,12 @@ def test_statistical_accuracy():
     
     print(f"Running {total_games} simulated Round 2 scenarios...")
     
+    # One engine for every scenario: reseeding its generator deals the same decks
+    # as a fresh CasinoRideTheBus(seed=i) would
+    engine = CasinoRideTheBus(record_history=False)
     for i in range(total_games):
-        engine = CasinoRideTheBus(seed=i)
-        game = engine.start_new_game(10.0)
+        engine.rng.seed(i)
+        game = engine.start_new_game(1000)
         
         # Round 1: Always guess red
         engine.make_guess(game, "red")
@@ -213,7 +233,564 @@ def test_statistical_accuracy():
     print("(Should be around 60-70% with optimal strategy)")
 
 
+def test_compact_state_roundtrip():
+    """Test that a game survives to_compact_tuple/from_compact_tuple"""
+    print("\n📦 Testing Compact Game State 📦\n")
+    
+    engine = CasinoRideTheBus(seed=7)
+    game = engine.start_new_game(2500)
+    engine.make_guess(game, "red")
+    
+    restored = GameState.from_compact_tuple(game.to_compact_tuple())
+    assert restored == game
+    print(f"Round-tripped game {restored.game_id} with {len(restored.deck)} cards left")
+
+
+def test_simulate_batch():
+    """Test the batch simulator is reproducible and only pays out valid amounts"""
+    print("\n🎲 Testing Batch Simulator 🎲\n")
+    
+    payouts = simulate_batch(5000, bet_cents=1000, seed=11)
+    assert payouts == simulate_batch(5000, bet_cents=1000, seed=11)
+    # Lost, cashed out at 2x or 4x (the strategy never cashes out later), or won all four rounds at 48x
+    assert set(payouts) <= {0, 2000, 4000, 48000}
+    print(f"Return to player over {len(payouts)} games: {sum(payouts) / (len(payouts) * 1000):.1%}")
+
+
+_TEMP_DIRS = []  # kept alive for the whole run; TemporaryDirectory removes them at exit
+
+
+def _temp_db_path():
+    """A fresh users database path in a temporary directory that is removed when the run ends"""
+    temp_dir = tempfile.TemporaryDirectory()
+    _TEMP_DIRS.append(temp_dir)
+    return os.path.join(temp_dir.name, 'casino_users.db')
+
+
+def _test_client():
+    """Flask test client for the app, with its user database kept out of the working tree"""
+    if 'CASINO_DB_PATH' not in os.environ:
+        os.environ['CASINO_DB_PATH'] = _temp_db_path()
+    from app import app
+    return app.test_client()
+
+
+def test_guest_flow():
+    """Test a guest session end to end through Flask's in-process test client"""
+    print("\n👤 Testing Guest Flow 👤\n")
+    
+    client = _test_client()
+    
+    assert client.get('/').status_code == 200
+    response = client.post('/play_as_guest')
+    assert response.status_code == 302
+    
+    response = client.post('/start_game', data={'bet_amount': '10'})
+    assert response.status_code == 302
+    assert client.get('/game').status_code == 200
+    assert client.get('/strategy').status_code == 200
+    
+    response = client.post('/make_guess', json={'guess': 'red'})
+    assert response.status_code == 200
+    data = response.get_json()
+    assert data['status'] in ('active', 'lost')
+    print(f"Guest drew {data.get('card')} - game is {data['status']}")
+
+
+def test_game_lock_conflict():
+    """Test that a move arriving while another holds the game's lock gets a 409"""
+    print("\n🔒 Testing Concurrent Move Rejection 🔒\n")
+    
+    client = _test_client()
+    client.post('/play_as_guest')
+    client.post('/start_game', data={'bet_amount': '10'})
+    with client.session_transaction() as sess:
+        game_id = sess['game_id']
+    
+    from app import game_store
+    token = game_store.acquire(game_id)
+    assert token is not None
+    response = client.post('/make_guess', json={'guess': 'red'})
+    assert response.status_code == 409
+    
+    game_store.release(game_id, token)
+    response = client.post('/make_guess', json={'guess': 'red'})
+    assert response.status_code == 200
+    print(f"Held lock gave 409; after release the move returned {response.get_json()['status']}")
+
+
+def test_profile_flashes_once():
+    """Test that a flash shown on the streamed profile page is not shown again"""
+    print("\n📣 Testing Profile Flash Messages 📣\n")
+    
+    client = _test_client()
+    from app import user_manager
+    user_manager.create_user('flashed', 'flashed@example.com', 'secret1')
+    with client.session_transaction() as sess:
+        sess['user_id'] = user_manager.get_user_by_username('flashed')['id']
+        sess['_flashes'] = [('success', 'Welcome back, flashed!')]
+    
+    assert b'Welcome back, flashed!' in client.get('/profile').data
+    assert b'Welcome back, flashed!' not in client.get('/profile').data
+    print("The flash was shown on the first profile view only")
+
+
+def test_unrecorded_game_reports_error():
+    """Test that a finished game the database fails to record is reported, not confirmed"""
+    print("\n🧯 Testing Failed Game Recording 🧯\n")
+    
+    client = _test_client()
+    from app import user_manager
+    user_manager.create_user('unlucky', 'unlucky@example.com', 'secret1')
+    user = user_manager.get_user_by_username('unlucky')
+    with client.session_transaction() as sess:
+        sess['user_id'] = user['id']
+    
+    # Stand in for a failed transaction; finalize_game reports those by returning False
+    finalize_game = user_manager.finalize_game
+    user_manager.finalize_game = lambda *args, **kwargs: False
+    try:
+        client.post('/start_game', data={'bet_amount': '10'})
+        for guess in ('red', 'higher', 'inside', 'hearts'):
+            response = client.post('/make_guess', json={'guess': guess})
+            if response.status_code != 200 or response.get_json()['status'] != 'active':
+                break
+        assert response.status_code == 500
+        assert response.get_json()['error'] == 'Could not record game'
+    finally:
+        user_manager.finalize_game = finalize_game
+    print("The finished game was reported as unrecorded")
+
+
+def test_json_provider_arguments():
+    """Test that the app's JSON provider honours json.dumps/json.loads arguments"""
+    print("\n🧩 Testing JSON Provider Arguments 🧩\n")
+    
+    _test_client()
+    from app import app
+    from decimal import Decimal
+    
+    dumped = app.json.dumps({'b': 1, 'a': 2}, sort_keys=True)
+    assert dumped.index('"a"') < dumped.index('"b"')
+    assert '"1.50"' in app.json.dumps({'amount': Decimal('1.50')}, default=str)
+    assert '\n' in app.json.dumps({'a': 1}, indent=2)
+    assert app.json.loads('{"amount": 1.5}', parse_float=Decimal) == {'amount': Decimal('1.5')}
+    assert app.json.loads('{"a": [1, 2]}') == {'a': [1, 2]}
+    print(f"Provider: {type(app.json).__name__}")
+
+
+def test_ttl_cache():
+    """Test LRU eviction, the idle TTL and expire() on TTLCache"""
+    print("\n⏱️ Testing TTL Cache ⏱️\n")
+    
+    cache = TTLCache(maxsize=2, ttl=0.5)
+    cache['a'] = 1
+    cache['b'] = 2
+    assert cache.get('a') == 1  # 'a' is now the most recently used
+    cache['c'] = 3
+    assert 'b' not in cache and len(cache) == 2
+    
+    # Each get pushes an entry's expiry forward
+    time.sleep(0.3)
+    assert cache.get('a') == 1
+    time.sleep(0.3)
+    assert cache.get('a') == 1
+    assert cache.get('c') is None
+    time.sleep(0.6)
+    assert cache.get('a', 'gone') == 'gone'
+    
+    cache['x'] = 1
+    cache['y'] = 2
+    assert cache.expire(now=time.monotonic() + 1) == 2 and len(cache) == 0
+    
+    # An absolute TTL runs from when the entry was set, however often it is read
+    cache = TTLCache(maxsize=2, ttl=0.5, refresh_on_get=False)
+    cache['a'] = 1
+    time.sleep(0.3)
+    assert cache.get('a') == 1
+    time.sleep(0.3)
+    assert cache.get('a') is None
+    print("Eviction, idle and absolute expiry, and expire() behave")
+
+
+def _check_game_store(store):
+    """Exercise the GameStore interface, including who may release a move lock"""
+    engine = CasinoRideTheBus(seed=5)
+    game = engine.start_new_game(1000)
+    store.set(game.game_id, game)
+    assert store.get(game.game_id) == game
+    
+    token = store.acquire(game.game_id)
+    assert token is not None
+    assert store.acquire(game.game_id) is None
+    store.release(game.game_id, 'not-the-holder')
+    assert store.acquire(game.game_id) is None
+    store.release(game.game_id, token)
+    token = store.acquire(game.game_id)
+    assert token is not None
+    store.release(game.game_id, token)
+    
+    store.delete(game.game_id)
+    assert store.get(game.game_id) is None
+
+
+def test_in_memory_game_store():
+    """Test the per-process game store"""
+    print("\n🗄️ Testing In-Memory Game Store 🗄️\n")
+    
+    store = InMemoryGameStore(maxsize=10, ttl=60)
+    _check_game_store(store)
+    
+    # A move on a game that isn't stored yet takes no lock, so releasing it can't free one
+    # that a later request took after the game appeared
+    game = CasinoRideTheBus(seed=6).start_new_game(1000)
+    early = store.acquire(game.game_id)
+    store.set(game.game_id, game)
+    holder = store.acquire(game.game_id)
+    assert early is not None and holder is not None
+    store.release(game.game_id, early)
+    assert store.acquire(game.game_id) is None
+    print("Locks are released only by the request that took them")
+
+
+def test_redis_game_store():
+    """Test the Redis game store against the server in REDIS_URL"""
+    import pytest
+    pytest.importorskip("redis")
+    if not os.getenv('REDIS_URL'):
+        pytest.skip("REDIS_URL is not set")
+    print("\n🗄️ Testing Redis Game Store 🗄️\n")
+    
+    import uuid
+    _check_game_store(RedisGameStore(os.environ['REDIS_URL'], ttl=60, prefix=f"test:{uuid.uuid4().hex}:"))
+
+
+def _make_legacy_db(path):
+    """Create a users file in the pre-cents schema (REAL dollars, hex SHA-256 passwords)"""
+    conn = sqlite3.connect(path)
+    conn.executescript("""
+        CREATE TABLE users (
+            id INTEGER PRIMARY KEY AUTOINCREMENT, username TEXT UNIQUE NOT NULL,
+            email TEXT UNIQUE NOT NULL, password_hash TEXT NOT NULL, salt TEXT NOT NULL,
+            bankroll REAL DEFAULT 1000.0, total_wagered REAL DEFAULT 0.0, total_won REAL DEFAULT 0.0,
+            games_played INTEGER DEFAULT 0, games_won INTEGER DEFAULT 0,
+            created_at TEXT DEFAULT CURRENT_TIMESTAMP, last_login TEXT DEFAULT CURRENT_TIMESTAMP
+        );
+        CREATE TABLE game_records (
+            id INTEGER PRIMARY KEY AUTOINCREMENT, user_id INTEGER NOT NULL, game_id TEXT NOT NULL,
+            bet_amount REAL NOT NULL, final_winnings REAL NOT NULL, rounds_completed INTEGER NOT NULL,
+            result TEXT NOT NULL, profit_loss REAL NOT NULL, cards_drawn TEXT, strategy_used TEXT,
+            created_at TEXT DEFAULT CURRENT_TIMESTAMP, FOREIGN KEY (user_id) REFERENCES users (id)
+        );
+        CREATE TABLE user_sessions (
+            session_id TEXT PRIMARY KEY, user_id INTEGER NOT NULL,
+            created_at TEXT DEFAULT CURRENT_TIMESTAMP, expires_at TEXT NOT NULL,
+            FOREIGN KEY (user_id) REFERENCES users (id)
+        );
+        CREATE TABLE daily_bonuses (
+            id INTEGER PRIMARY KEY AUTOINCREMENT, user_id INTEGER NOT NULL, bonus_amount REAL NOT NULL,
+            claimed_date TEXT NOT NULL, FOREIGN KEY (user_id) REFERENCES users (id)
+        );
+    """)
+    salt = "ab" * 32
+    conn.execute("""
+        INSERT INTO users (username, email, password_hash, salt, bankroll, total_wagered, total_won,
+                           games_played, games_won)
+        VALUES ('oldtimer', 'old@example.com', ?, ?, 1012.5, 30.1, 42.6, 3, 1)
+    """, (hashlib.sha256(("hunter22" + salt).encode()).hexdigest(), salt))
+    conn.executemany("""
+        INSERT INTO game_records (user_id, game_id, bet_amount, final_winnings, rounds_completed,
+                                  result, profit_loss)
+        VALUES (1, ?, ?, ?, ?, ?, ?)
+    """, [('g1', 10.1, 20.2, 1, 'cashed_out', 10.1), ('g2', 10.0, 0.0, 1, 'lost', -10.0),
+          ('g3', 10.0, 22.4, 4, 'won', 12.4)])
+    conn.execute("INSERT INTO daily_bonuses (user_id, bonus_amount, claimed_date) VALUES (1, 75.5, '2024-01-01')")
+    conn.commit()
+    conn.close()
+
+
+def test_concurrent_startup_migration():
+    """Test that several processes opening an old file at once all start and migrate it once"""
+    print("\n🚦 Testing Concurrent Startup Migration 🚦\n")
+    
+    path = _temp_db_path()
+    _make_legacy_db(path)
+    
+    repo_dir = os.path.dirname(os.path.abspath(__file__))
+    script = 'import sys; from user_manager import UserManager; UserManager(sys.argv[1])'
+    workers = [subprocess.Popen([sys.executable, '-c', script, path], cwd=repo_dir, stderr=subprocess.PIPE)
+               for _ in range(6)]
+    for worker in workers:
+        _, stderr = worker.communicate(timeout=60)
+        assert worker.returncode == 0, stderr.decode()
+    
+    conn = sqlite3.connect(path)
+    assert conn.execute("PRAGMA user_version").fetchone()[0] == SCHEMA_VERSION
+    # Migrated exactly once: the totals were carried over, not re-added by the game rows
+    assert conn.execute("SELECT bankroll_cents, total_wagered_cents, games_played FROM users").fetchone() == (101250, 3010, 3)
+    assert conn.execute("SELECT COUNT(*) FROM game_records").fetchone()[0] == 3
+    conn.close()
+    print(f"{len(workers)} processes started cleanly on one legacy file")
+
+
+def test_user_cache_sees_other_writers():
+    """Test that one UserManager's writes reach another one's reads on the same file"""
+    print("\n🔄 Testing User Cache Across Instances 🔄\n")
+    
+    path = _temp_db_path()
+    writer = UserManager(path)
+    cached = UserManager(path, user_cache_ttl=0.5)
+    uncached = UserManager(path, user_cache_ttl=0)
+    
+    writer.create_user('sharer', 'sharer@example.com', 'secret1')
+    user_id = writer.get_user_by_username('sharer')['id']
+    before = cached.get_user_by_id(user_id)['bankroll_cents']
+    uncached.get_user_by_id(user_id)
+    
+    writer.add_funds(user_id, 500)
+    assert uncached.get_user_by_id(user_id)['bankroll_cents'] == before + 500
+    
+    # Polling must not keep the stale row alive; it is re-read once the TTL has run out
+    deadline = time.monotonic() + 2
+    while cached.get_user_by_id(user_id)['bankroll_cents'] == before:
+        assert time.monotonic() < deadline, "cached row outlived its TTL"
+        time.sleep(0.1)
+    
+    for manager in (writer, cached, uncached):
+        manager.close()
+    print("Another instance's write was visible immediately with the cache off, and within the TTL with it on")
+
+
+def test_legacy_migration():
+    """Test that a pre-cents file is rebuilt in cents with its rows and foreign keys intact"""
+    print("\n🏗️ Testing Legacy Migration 🏗️\n")
+    
+    path = _temp_db_path()
+    _make_legacy_db(path)
+    manager = UserManager(path)
+    
+    user = manager.get_user_by_username('oldtimer')
+    assert (user['bankroll_cents'], user['total_wagered_cents'], user['total_won_cents']) == (101250, 3010, 4260)
+    assert (user['games_played'], user['games_won']) == (3, 1)
+    assert sorted(game.profit_loss_cents for game in manager.get_user_game_history(user['id'])) == [-1000, 1010, 1240]
+    
+    conn = sqlite3.connect(path)
+    tables = {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+    assert not any(name.endswith('_legacy') for name in tables)
+    assert conn.execute("SELECT bonus_cents FROM daily_bonuses").fetchone()[0] == 7550
+    # The rename must not have left game_records pointing at the dropped users_legacy
+    assert conn.execute("SELECT \"table\" FROM pragma_foreign_key_list('game_records')").fetchone()[0] == 'users'
+    assert manager._conn.execute("PRAGMA legacy_alter_table").fetchone()[0] == 0
+    conn.close()
+    print(f"Migrated {user['username']} with ${format_cents(user['bankroll_cents'])} and 3 games")
+
+
+def test_legacy_password_upgrade():
+    """Test that hex SHA-256 and hex PBKDF2 hashes still log in and are upgraded on the way"""
+    print("\n🔑 Testing Legacy Password Upgrade 🔑\n")
+    
+    path = _temp_db_path()
+    _make_legacy_db(path)  # 'oldtimer' has a hex SHA-256 hash
+    manager = UserManager(path)
+    conn = sqlite3.connect(path)
+    salt = "cd" * 16
+    hex_pbkdf2 = hashlib.pbkdf2_hmac("sha256", b"swordfish", bytes.fromhex(salt), 1000, 32).hex()
+    with conn:
+        conn.execute("""
+            INSERT INTO users (username, email, password_hash, salt, password_iterations)
+            VALUES ('hexuser', 'hex@example.com', ?, ?, 1000)
+        """, (hex_pbkdf2, salt))
+    
+    for username, password in (('oldtimer', 'hunter22'), ('hexuser', 'swordfish')):
+        assert manager.login_user(username, 'wrong-password')[0] is None
+        user, message = manager.login_user(username, password)
+        assert user is not None, message
+        
+        stored_hash, stored_salt, iterations = conn.execute("""
+            SELECT password_hash, salt, password_iterations FROM users WHERE username = ?
+        """, (username,)).fetchone()
+        assert isinstance(stored_hash, bytes) and isinstance(stored_salt, bytes)
+        assert iterations == PASSWORD_ITERATIONS
+        
+        # The upgraded hash still accepts the password, and only that password
+        assert manager.login_user(username, password)[0] is not None
+        assert manager.login_user(username, 'wrong-password')[0] is None
+    
+    conn.close()
+    manager.close()
+    print("Both legacy hashes logged in and were rehashed with PBKDF2")
+
+
+def test_record_games_batch():
+    """Test that a batch of games updates each player's totals and bankroll once per game"""
+    print("\n🧾 Testing Batch Game Recording 🧾\n")
+    
+    manager = UserManager(_temp_db_path())
+    manager.create_user('batcher1', 'batcher1@example.com', 'secret1')
+    manager.create_user('batcher2', 'batcher2@example.com', 'secret2')
+    first = manager.get_user_by_username('batcher1')
+    second = manager.get_user_by_username('batcher2')
+    
+    assert manager.record_games_batch([
+        {'user_id': first['id'], 'game_id': 'b1', 'bet_cents': 1000, 'winnings_cents': 48000,
+         'rounds_completed': 4, 'result': 'won', 'bankroll_delta_cents': 47000, 'cards_drawn': [1, 2, 3, 4]},
+        {'user_id': first['id'], 'game_id': 'b2', 'bet_cents': 1000, 'winnings_cents': 0,
+         'rounds_completed': 1, 'result': 'lost', 'bankroll_delta_cents': -1000},
+        {'user_id': second['id'], 'game_id': 'b3', 'bet_cents': 500, 'winnings_cents': 1000,
+         'rounds_completed': 1, 'result': 'cashed_out', 'bankroll_delta_cents': 500},
+    ])
+    
+    stats = manager.get_user_stats(first['id'])
+    assert (stats['games_played'], stats['games_won']) == (2, 1)
+    assert (stats['total_wagered_cents'], stats['total_won_cents']) == (2000, 48000)
+    assert stats['bankroll_cents'] == first['bankroll_cents'] + 46000
+    assert manager.get_user_by_id(second['id'])['bankroll_cents'] == second['bankroll_cents'] + 500
+    assert manager.get_user_stats(second['id'])['games_played'] == 1
+    
+    # A batch that fails part way records nothing
+    assert not manager.record_games_batch([
+        {'user_id': second['id'], 'game_id': 'b4', 'bet_cents': 500, 'winnings_cents': 0,
+         'rounds_completed': 1, 'result': 'lost'},
+        {'user_id': second['id'], 'game_id': 'b5'},
+    ])
+    assert manager.get_user_stats(second['id'])['games_played'] == 1
+    manager.close()
+    print(f"batcher1 net profit ${format_cents(stats['net_profit_cents'])} over {stats['games_played']} games")
+
+
+def test_game_history_paging():
+    """Test that before_id pages through a player's games newest first without gaps or repeats"""
+    print("\n📜 Testing Game History Paging 📜\n")
+    
+    manager = UserManager(_temp_db_path())
+    manager.create_user('pager', 'pager@example.com', 'secret1')
+    user_id = manager.get_user_by_username('pager')['id']
+    for i in range(5):
+        assert manager.record_game(user_id, f'p{i}', 1000, 0, 1, 'lost')
+    
+    pages = []
+    before_id = None
+    while True:
+        page = manager.get_user_game_history(user_id, limit=2, before_id=before_id)
+        if not page:
+            break
+        pages.append([game.game_id for game in page])
+        before_id = page[-1].id
+    assert pages == [['p4', 'p3'], ['p2', 'p1'], ['p0']]
+    
+    # The dict variant pages the same way
+    p2_id = manager.get_user_game_history(user_id)[2].id
+    page = manager.get_game_history(user_id, limit=2, before_id=p2_id)
+    assert [game['game_id'] for game in page] == ['p1', 'p0']
+    manager.close()
+    print(f"Paged 5 games as {pages}")
+
+
+def test_session_expiry():
+    """Test that sessions stop resolving once expired and are pruned"""
+    print("\n⌛ Testing Session Expiry ⌛\n")
+    
+    path = _temp_db_path()
+    manager = UserManager(path)
+    manager.create_user('sleeper', 'sleeper@example.com', 'secret1')
+    user_id = manager.get_user_by_username('sleeper')['id']
+    session_id = manager.create_session(user_id)
+    assert manager.get_user_by_session(session_id).id == user_id
+    assert manager.get_user_by_session('no-such-session') is None
+    
+    with manager._write() as conn:
+        conn.execute("UPDATE user_sessions SET expires_at = ? WHERE session_id = ?",
+                     (int(time.time()) - 1, session_id))
+    
+    # A fresh manager has nothing cached, so it reads the lapsed expiry
+    other = UserManager(path)
+    assert other.get_user_by_session(session_id) is None
+    assert other.prune_sessions() == 1
+    assert other.prune_sessions() == 0
+    
+    # Creating a session also sweeps lapsed ones
+    live_id = other.create_session(user_id)
+    with other._write() as conn:
+        conn.execute("UPDATE user_sessions SET expires_at = ? WHERE session_id = ?",
+                     (int(time.time()) - 1, live_id))
+    other.create_session(user_id)
+    with other._reader() as conn:
+        assert conn.execute("SELECT COUNT(*) FROM user_sessions").fetchone()[0] == 1
+    
+    manager.close()
+    other.close()
+    print("Expired sessions were rejected and pruned")
+
+
+def test_daily_bonus_once():
+    """Test that concurrent daily bonus claims pay out exactly once"""
+    print("\n🎁 Testing Daily Bonus Race 🎁\n")
+    
+    manager = UserManager(_temp_db_path())
+    manager.create_user('claimer', 'claimer@example.com', 'secret1')
+    user = manager.get_user_by_username('claimer')
+    
+    claims = 32
+    bonuses = []
+    threads = [threading.Thread(target=lambda: bonuses.append(manager.claim_daily_bonus(user['id'])))
+               for _ in range(claims)]
+    
+    # Hold the write lock while every claim passes the already-claimed check on a reader,
+    # so they all race for the insert
+    with manager._lock:
+        for thread in threads:
+            thread.start()
+        time.sleep(0.5)
+    for thread in threads:
+        thread.join()
+    
+    paid = [bonus for bonus in bonuses if bonus]
+    assert len(bonuses) == claims and len(paid) == 1
+    assert 5000 <= paid[0] <= 10000
+    assert manager.get_user_by_id(user['id'])['bankroll_cents'] == user['bankroll_cents'] + paid[0]
+    assert manager.claim_daily_bonus(user['id']) == 0
+    with manager._reader() as conn:
+        assert conn.execute("SELECT COUNT(*) FROM daily_bonuses").fetchone()[0] == 1
+    manager.close()
+    print(f"{claims} concurrent claims paid ${format_cents(paid[0])} once")
+
+
+
+def test_old_sqlite_refused():
+    """Test that UserManager refuses to start on an SQLite without UPDATE ... RETURNING"""
+    print("\n🧱 Testing SQLite Version Check 🧱\n")
+    
+    version_info = sqlite3.sqlite_version_info
+    sqlite3.sqlite_version_info = (3, 31, 1)
+    try:
+        UserManager(_temp_db_path())
+    except RuntimeError as e:
+        print(f"Refused: {e}")
+    else:
+        raise AssertionError("UserManager started on SQLite 3.31")
+    finally:
+        sqlite3.sqlite_version_info = version_info
+
+
 if __name__ == "__main__":
     test_full_game()
     test_strategy_system() 
-    test_statistical_accuracy()
\ No newline at end of file
+    test_statistical_accuracy()
+    test_compact_state_roundtrip()
+    test_simulate_batch()
+    test_guest_flow()
+    test_game_lock_conflict()
+    test_profile_flashes_once()
+    test_unrecorded_game_reports_error()
+    test_json_provider_arguments()
+    test_ttl_cache()
+    test_in_memory_game_store()
+    test_concurrent_startup_migration()
+    test_user_cache_sees_other_writers()
+    test_legacy_migration()
+    test_legacy_password_upgrade()
+    test_record_games_batch()
+    test_game_history_paging()
+    test_session_expiry()
+    test_daily_bonus_once()
+    test_old_sqlite_refused()
\ No newline at end of file
@@ -0,0 +1,82 @@
+"""
+Bounded in-memory cache for Casino Ride the Bus
+A thread-safe LRU mapping whose entries also expire after a period of inactivity
+(or, with refresh_on_get=False, a fixed time after they were stored)
+"""
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Hashable, Optional
+
+
+class TTLCache:
+    """LRU cache with a maximum size and an idle time-to-live per entry"""
+
+    def __init__(self, maxsize: int, ttl: float, refresh_on_get: bool = True):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        # False makes ttl absolute: entries expire ttl after they were set, however often
+        # they are read, and eviction goes oldest-stored first
+        self.refresh_on_get = refresh_on_get
+        self._data: "OrderedDict[Hashable, tuple[float, Any]]" = OrderedDict()
+        self._lock = threading.RLock()
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._data)
+
+    def __contains__(self, key: Hashable) -> bool:
+        return self.get(key) is not None
+
+    def __getitem__(self, key: Hashable) -> Any:
+        value = self.get(key)
+        if value is None:
+            raise KeyError(key)
+        return value
+
+    def __setitem__(self, key: Hashable, value: Any):
+        with self._lock:
+            self._data[key] = (time.monotonic() + self.ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def __delitem__(self, key: Hashable):
+        with self._lock:
+            del self._data[key]
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        """Return a live entry (refreshing its expiry unless ttl is absolute), or default if missing/expired"""
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                return default
+            now = time.monotonic()
+            if item[0] <= now:
+                del self._data[key]
+                return default
+            if self.refresh_on_get:
+                self._data[key] = (now + self.ttl, item[1])
+                self._data.move_to_end(key)
+            return item[1]
+
+    def pop(self, key: Hashable, default: Any = None) -> Any:
+        """Remove an entry and return its value"""
+        with self._lock:
+            item = self._data.pop(key, None)
+            return default if item is None else item[1]
+
+    def expire(self, now: Optional[float] = None) -> int:
+        """Evict expired entries; returns how many were removed"""
+        now = time.monotonic() if now is None else now
+        removed = 0
+        with self._lock:
+            # Entries are kept in expiry order (last-touched, or last-set when ttl is absolute),
+            # so expired ones sit at the front
+            while self._data:
+                key, (expires_at, _) = next(iter(self._data.items()))
+                if expires_at > now:
+                    break
+                del self._data[key]
+                removed += 1
+        return removed
@@ -4,10 +4,33 @@ Handles user registration, authentication, bankroll management, and game history
 """
 import sqlite3
 import hashlib
+import hmac
+import json
+import random
 import secrets
-from datetime import datetime
-from typing import Optional, List, Dict
-from dataclasses import dataclass
+import threading
+import time
+import queue
+from contextlib import contextmanager
+from urllib.request import pathname2url
+from typing import Optional, List, Dict, Iterator
+from dataclasses import dataclass, asdict, fields
+
+from money import STARTING_BANKROLL_CENTS
+from ttl_cache import TTLCache
+
+# Bump when the schema changes; init_database() migrates older files forward
+SCHEMA_VERSION = 5
+
+# UPDATE ... RETURNING arrived in SQLite 3.35; get_user_stats() also needs the JSON1 functions
+MIN_SQLITE_VERSION = (3, 35, 0)
+
+PASSWORD_ITERATIONS = 200_000  # PBKDF2-SHA256 rounds; older hashes are upgraded at login
+SESSION_CACHE_TTL = 60  # seconds an idle session lookup stays cached
+USER_CACHE_TTL = 15  # seconds a user row stays cached after it is read (this process's writes drop it at once)
+_MAX_ROWID = (1 << 63) - 1  # history's "before_id" when starting from the newest game
+
+READ_POOL_SIZE = 4  # read-only connections for the lookup, history and stats queries
 
 
 @dataclass
@@ -15,9 +38,9 @@ class User:
     id: int
     username: str
     email: str
-    bankroll: float
-    total_wagered: float
-    total_won: float
+    bankroll_cents: int
+    total_wagered_cents: int
+    total_won_cents: int
     games_played: int
     games_won: int
     created_at: str
@@ -29,37 +52,160 @@ class GameRecord:
     id: int
     user_id: int
     game_id: str
-    bet_amount: float
-    final_winnings: float
+    bet_cents: int
+    winnings_cents: int
     rounds_completed: int
     result: str  # 'won', 'lost', 'cashed_out'
-    profit_loss: float
+    profit_loss_cents: int
     created_at: str
 
 
+# Column lists in dataclass field order, so User(*row) and GameRecord(*row) line up
+_USER_COLUMNS = ", ".join(f.name for f in fields(User))
+_GAME_RECORD_COLUMNS = ", ".join(f.name for f in fields(GameRecord))
+
+
+def _cards_json(cards_drawn: Optional[List]) -> str:
+    """Compact JSON for a game's cards (e.g. "[12,40,7]" for Card.code values)"""
+    return json.dumps(cards_drawn or [], separators=(',', ':'), default=str)
+
+
 class UserManager:
     """Manages user accounts, authentication, and game records"""
     
-    def __init__(self, db_path: str = "casino_users.db"):
+    def __init__(self, db_path: str = "casino_users.db", user_cache_ttl: float = USER_CACHE_TTL):
+        # The query methods swallow database errors, so an old SQLite would only show up
+        # as failed logins and "insufficient funds"; refuse to start instead
+        if sqlite3.sqlite_version_info < MIN_SQLITE_VERSION:
+            raise RuntimeError(f"UserManager requires SQLite {'.'.join(map(str, MIN_SQLITE_VERSION))} or newer; "
+                               f"this Python is linked against {sqlite3.sqlite_version}")
+        
         self.db_path = db_path
+        # One connection for the process; the lock keeps each method's statements
+        # (and its commit) together when Flask serves requests on several threads
+        self._conn = self._connect()
+        try:
+            self._conn.execute("SELECT json_group_object('key', 1)")
+        except sqlite3.OperationalError:
+            self._conn.close()
+            raise RuntimeError(f"UserManager requires SQLite's JSON1 functions, which this build "
+                               f"({sqlite3.sqlite_version}) lacks") from None
+        self._lock = threading.RLock()
         self.init_database()
+        
+        # session_id -> (user_id, expires_at); a session row never changes once written
+        self._session_cache = TTLCache(maxsize=10000, ttl=SESSION_CACHE_TTL)
+        
+        # user_id -> user dict, dropped by every write to that user. Writes from other processes
+        # can't drop it, so the TTL is absolute (reads don't extend it) and bounds how stale a
+        # row can get; user_cache_ttl=0 turns the cache off. Usernames never change, so
+        # username -> user_id needs no invalidation
+        self._user_cache = TTLCache(maxsize=10000, ttl=user_cache_ttl, refresh_on_get=False)
+        self._cache_users = user_cache_ttl > 0
+        self._user_ids = TTLCache(maxsize=10000, ttl=USER_CACHE_TTL)
+        self._user_cache_lock = threading.Lock()
+        self._user_cache_generation = 0
+        
+        # Reads skip the lock and run side by side on their own read-only connections
+        # (an in-memory database only exists on the shared connection, so it has no pool)
+        self._read_pool = None
+        if db_path != ":memory:":
+            self._read_pool = queue.Queue()
+            for _ in range(READ_POOL_SIZE):
+                self._read_pool.put(self._connect(read_only=True))
+    
+    def _connect(self, read_only: bool = False) -> sqlite3.Connection:
+        """Open a connection to the database with the PRAGMAs the app runs under"""
+        if read_only:
+            conn = sqlite3.connect(f"file:{pathname2url(self.db_path)}?mode=ro", uri=True,
+                                   check_same_thread=False)
+            conn.execute("PRAGMA query_only = ON")
+        else:
+            conn = sqlite3.connect(self.db_path, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode = WAL")  # readers don't block the writer
+            conn.execute("PRAGMA synchronous = NORMAL")  # WAL stays consistent; skips an fsync per commit
+        conn.execute("PRAGMA busy_timeout = 5000")
+        conn.execute("PRAGMA temp_store = MEMORY")
+        conn.execute("PRAGMA cache_size = -20000")  # ~20 MB page cache
+        conn.execute("PRAGMA mmap_size = 268435456")  # read pages straight from a 256 MB mapping
+        # Rows still unpack and index like tuples, and dict(row) is built in C
+        conn.row_factory = sqlite3.Row
+        return conn
+    
+    @contextmanager
+    def _reader(self) -> Iterator[sqlite3.Connection]:
+        """Check out a read-only connection from the pool for the length of a query"""
+        if self._read_pool is None:
+            with self._lock:
+                yield self._conn
+            return
+        conn = self._read_pool.get()
+        try:
+            yield conn
+        finally:
+            self._read_pool.put(conn)
+    
+    @contextmanager
+    def _write(self, *user_ids: int) -> Iterator[sqlite3.Connection]:
+        """Run one transaction on the shared connection, then drop the users' cached rows"""
+        try:
+            with self._lock, self._conn as conn:
+                yield conn
+        finally:
+            # After the commit, so a reader can't cache the old row once it's dropped
+            if user_ids:
+                with self._user_cache_lock:
+                    self._user_cache_generation += 1
+                    for user_id in user_ids:
+                        self._user_cache.pop(user_id)
+    
+    def close(self):
+        """Close the shared database connection and the read pool"""
+        with self._lock:
+            self._conn.close()
+        while self._read_pool is not None and not self._read_pool.empty():
+            self._read_pool.get_nowait().close()
     
     def init_database(self):
         """Initialize the database with required tables"""
-        conn = sqlite3.connect(self.db_path)
+        conn = self._conn
+        
+        # Warm start: the file is already at this schema, so there is no DDL to run
+        if conn.execute("PRAGMA user_version").fetchone()[0] >= SCHEMA_VERSION:
+            return
+        
+        # Take the write lock up front: a deferred BEGIN would read and then need to upgrade
+        # to write, which busy_timeout can't wait out, so racing processes would fail
         cursor = conn.cursor()
+        cursor.execute("BEGIN IMMEDIATE")
         
-        # Users table
-        cursor.execute("""
+        # Another process may have migrated the file while we waited for the lock
+        version = cursor.execute("PRAGMA user_version").fetchone()[0]
+        if version >= SCHEMA_VERSION:
+            conn.rollback()
+            return
+        
+        # Files from before SCHEMA_VERSION 1 stored money as REAL dollars
+        legacy = version < 1 and self._has_column(cursor, 'users', 'bankroll')
+        if legacy:
+            # Keep the other tables' foreign keys pointing at "users" during the rebuild
+            cursor.execute("PRAGMA legacy_alter_table = ON")
+            for table in ('users', 'game_records', 'daily_bonuses'):
+                cursor.execute(f"ALTER TABLE {table} RENAME TO {table}_legacy")
+            cursor.execute("PRAGMA legacy_alter_table = OFF")
+        
+        # Users table (all money columns are integer cents)
+        cursor.execute(f"""
             CREATE TABLE IF NOT EXISTS users (
                 id INTEGER PRIMARY KEY AUTOINCREMENT,
                 username TEXT UNIQUE NOT NULL,
                 email TEXT UNIQUE NOT NULL,
-                password_hash TEXT NOT NULL,
-                salt TEXT NOT NULL,
-                bankroll REAL DEFAULT 1000.0,
-                total_wagered REAL DEFAULT 0.0,
-                total_won REAL DEFAULT 0.0,
+                password_hash BLOB NOT NULL,
+                salt BLOB NOT NULL,
+                password_iterations INTEGER NOT NULL DEFAULT 0,
+                bankroll_cents INTEGER DEFAULT {STARTING_BANKROLL_CENTS},
+                total_wagered_cents INTEGER DEFAULT 0,
+                total_won_cents INTEGER DEFAULT 0,
                 games_played INTEGER DEFAULT 0,
                 games_won INTEGER DEFAULT 0,
                 created_at TEXT DEFAULT CURRENT_TIMESTAMP,
@@ -73,11 +219,11 @@ class UserManager:
                 id INTEGER PRIMARY KEY AUTOINCREMENT,
                 user_id INTEGER NOT NULL,
                 game_id TEXT NOT NULL,
-                bet_amount REAL NOT NULL,
-                final_winnings REAL NOT NULL,
+                bet_cents INTEGER NOT NULL,
+                winnings_cents INTEGER NOT NULL,
                 rounds_completed INTEGER NOT NULL,
                 result TEXT NOT NULL,
-                profit_loss REAL NOT NULL,
+                profit_loss_cents INTEGER NOT NULL,
                 cards_drawn TEXT,
                 strategy_used TEXT,
                 created_at TEXT DEFAULT CURRENT_TIMESTAMP,
@@ -85,13 +231,18 @@ class UserManager:
             )
         """)
         
+        # SCHEMA_VERSION 4 stores session expiry as epoch seconds; text-dated sessions
+        # from older files are discarded (they only lasted until the end of their day anyway)
+        if version < 4:
+            cursor.execute("DROP TABLE IF EXISTS user_sessions")
+        
         # User sessions table (for login management)
         cursor.execute("""
             CREATE TABLE IF NOT EXISTS user_sessions (
                 session_id TEXT PRIMARY KEY,
                 user_id INTEGER NOT NULL,
                 created_at TEXT DEFAULT CURRENT_TIMESTAMP,
-                expires_at TEXT NOT NULL,
+                expires_at INTEGER NOT NULL,
                 FOREIGN KEY (user_id) REFERENCES users (id)
             )
         """)
@@ -101,26 +252,124 @@ class UserManager:
             CREATE TABLE IF NOT EXISTS daily_bonuses (
                 id INTEGER PRIMARY KEY AUTOINCREMENT,
                 user_id INTEGER NOT NULL,
-                bonus_amount REAL NOT NULL,
+                bonus_cents INTEGER NOT NULL,
                 claimed_date TEXT NOT NULL,
                 FOREIGN KEY (user_id) REFERENCES users (id)
             )
         """)
         
+        if legacy:
+            self._copy_legacy_rows(cursor)
+        
+        # SCHEMA_VERSION 2: password_iterations of 0 marks a pre-PBKDF2 SHA-256 hash
+        if not self._has_column(cursor, 'users', 'password_iterations'):
+            cursor.execute("ALTER TABLE users ADD COLUMN password_iterations INTEGER NOT NULL DEFAULT 0")
+        
+        # SCHEMA_VERSION 3 adds the indexes and the totals trigger that follow
+        
+        # Leaderboard order, so get_leaderboard() walks the top N instead of sorting every player
+        cursor.execute("""
+            CREATE INDEX IF NOT EXISTS idx_users_net_profit
+            ON users ((total_won_cents - total_wagered_cents) DESC)
+            WHERE games_played > 0
+        """)
+        
+        # Per-user lookups: the 7-day window, history pages, best/worst game, sessions
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_game_records_user_created ON game_records (user_id, created_at DESC)")
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_game_records_user_id ON game_records (user_id, id)")
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_game_records_user_profit ON game_records (user_id, profit_loss_cents)")
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_user_sessions_user_id ON user_sessions (user_id)")
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_user_sessions_expires ON user_sessions (expires_at)")
+        
+        # SCHEMA_VERSION 5 makes "one bonus per user per day" a constraint (an old race could
+        # have recorded two claims; the first is kept)
+        if version < 5:
+            cursor.execute("DROP INDEX IF EXISTS idx_daily_bonuses_user_date")
+            cursor.execute("""
+                DELETE FROM daily_bonuses WHERE id NOT IN (
+                    SELECT MIN(id) FROM daily_bonuses GROUP BY user_id, claimed_date
+                )
+            """)
+        cursor.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_daily_bonuses_user_date ON daily_bonuses (user_id, claimed_date)")
+        
+        # Every game row rolls itself into its player's totals, so recording a game is one INSERT
+        # (created after the legacy copy above, whose users rows already carry their totals)
+        cursor.execute("""
+            CREATE TRIGGER IF NOT EXISTS trg_game_records_totals AFTER INSERT ON game_records
+            BEGIN
+                UPDATE users SET 
+                    total_wagered_cents = total_wagered_cents + NEW.bet_cents,
+                    total_won_cents = total_won_cents + NEW.winnings_cents,
+                    games_played = games_played + 1,
+                    games_won = games_won + (NEW.result = 'won')
+                WHERE id = NEW.user_id;
+            END
+        """)
+        
+        cursor.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
         conn.commit()
-        conn.close()
     
-    def hash_password(self, password: str) -> tuple[str, str]:
-        """Hash password with salt"""
-        salt = secrets.token_hex(32)
-        password_hash = hashlib.sha256((password + salt).encode()).hexdigest()
-        return password_hash, salt
+    def _has_column(self, cursor, table: str, column: str) -> bool:
+        """Check whether an existing table has the given column"""
+        return any(row[1] == column for row in cursor.execute(f"PRAGMA table_info({table})"))
     
-    def verify_password(self, password: str, password_hash: str, salt: str) -> bool:
-        """Verify password against hash"""
-        return hashlib.sha256((password + salt).encode()).hexdigest() == password_hash
+    def _copy_legacy_rows(self, cursor):
+        """Move rows from the *_legacy dollar tables into the cents tables, then drop them"""
+        cursor.execute("""
+            INSERT INTO users (id, username, email, password_hash, salt, bankroll_cents,
+                               total_wagered_cents, total_won_cents, games_played, games_won,
+                               created_at, last_login)
+            SELECT id, username, email, password_hash, salt,
+                   CAST(ROUND(bankroll * 100) AS INTEGER),
+                   CAST(ROUND(total_wagered * 100) AS INTEGER),
+                   CAST(ROUND(total_won * 100) AS INTEGER),
+                   games_played, games_won, created_at, last_login
+            FROM users_legacy
+        """)
+        
+        cursor.execute("""
+            INSERT INTO game_records (id, user_id, game_id, bet_cents, winnings_cents,
+                                      rounds_completed, result, profit_loss_cents,
+                                      cards_drawn, strategy_used, created_at)
+            SELECT id, user_id, game_id,
+                   CAST(ROUND(bet_amount * 100) AS INTEGER),
+                   CAST(ROUND(final_winnings * 100) AS INTEGER),
+                   rounds_completed, result,
+                   CAST(ROUND(profit_loss * 100) AS INTEGER),
+                   cards_drawn, strategy_used, created_at
+            FROM game_records_legacy
+        """)
+        
+        cursor.execute("""
+            INSERT INTO daily_bonuses (id, user_id, bonus_cents, claimed_date)
+            SELECT id, user_id, CAST(ROUND(bonus_amount * 100) AS INTEGER), claimed_date
+            FROM daily_bonuses_legacy
+        """)
+        
+        for table in ('users', 'game_records', 'daily_bonuses'):
+            cursor.execute(f"DROP TABLE {table}_legacy")
+    
+    def hash_password(self, password: str, salt: Optional[bytes] = None,
+                      iterations: int = PASSWORD_ITERATIONS) -> tuple[bytes, bytes]:
+        """Hash password with a (new, unless given) raw salt using PBKDF2-SHA256"""
+        if salt is None:
+            salt = secrets.token_bytes(16)
+        return hashlib.pbkdf2_hmac("sha256", password.encode(), salt, iterations, 32), salt
     
-    def register_user(self, username: str, email: str, password: str, starting_bankroll: float = 1000.0) -> tuple[bool, str]:
+    def verify_password(self, password: str, password_hash, salt,
+                        iterations: int = PASSWORD_ITERATIONS) -> bool:
+        """Verify password against hash in constant time"""
+        if isinstance(salt, str):
+            # Hex text from older accounts: SHA-256 (iterations 0) or hex-encoded PBKDF2
+            if iterations == 0:
+                derived = hashlib.sha256((password + salt).encode()).hexdigest()
+            else:
+                derived = hashlib.pbkdf2_hmac("sha256", password.encode(), bytes.fromhex(salt), iterations, 32).hex()
+        else:
+            derived = self.hash_password(password, salt, iterations)[0]
+        return hmac.compare_digest(derived, password_hash)
+    
+    def register_user(self, username: str, email: str, password: str, starting_bankroll_cents: int = STARTING_BANKROLL_CENTS) -> tuple[bool, str]:
         """Register a new user"""
         if len(username) < 3:
             return False, "Username must be at least 3 characters"
@@ -129,69 +378,71 @@ class UserManager:
         if "@" not in email:
             return False, "Invalid email address"
         
+        # Hash before taking the lock; PBKDF2 is deliberately slow
+        password_hash, salt = self.hash_password(password)
+        
         try:
-            conn = sqlite3.connect(self.db_path)
-            cursor = conn.cursor()
-            
-            # Check if username or email already exists
-            cursor.execute("SELECT id FROM users WHERE username = ? OR email = ?", (username, email))
-            if cursor.fetchone():
-                return False, "Username or email already exists"
-            
-            password_hash, salt = self.hash_password(password)
-            
-            cursor.execute("""
-                INSERT INTO users (username, email, password_hash, salt, bankroll)
-                VALUES (?, ?, ?, ?, ?)
-            """, (username, email, password_hash, salt, starting_bankroll))
-            
-            conn.commit()
-            conn.close()
-            return True, "Account created successfully"
-            
+            with self._write() as conn:
+                cursor = conn.cursor()
+                
+                # Check if username or email already exists
+                cursor.execute("SELECT id FROM users WHERE username = ? OR email = ?", (username, email))
+                if cursor.fetchone():
+                    return False, "Username or email already exists"
+                
+                cursor.execute("""
+                    INSERT INTO users (username, email, password_hash, salt, password_iterations, bankroll_cents)
+                    VALUES (?, ?, ?, ?, ?, ?)
+                """, (username, email, password_hash, salt, PASSWORD_ITERATIONS, starting_bankroll_cents))
+                
+                return True, "Account created successfully"
+                
         except Exception as e:
             return False, f"Registration failed: {str(e)}"
     
     def login_user(self, username: str, password: str) -> tuple[Optional[User], str]:
         """Authenticate user and return user object"""
         try:
-            conn = sqlite3.connect(self.db_path)
-            cursor = conn.cursor()
-            
-            cursor.execute("""
-                SELECT id, username, email, password_hash, salt, bankroll, 
-                       total_wagered, total_won, games_played, games_won, created_at
-                FROM users WHERE username = ?
-            """, (username,))
+            with self._reader() as conn:
+                cursor = conn.cursor()
+                
+                cursor.execute("""
+                    SELECT id, password_hash, salt, password_iterations
+                    FROM users WHERE username = ?
+                """, (username,))
+                
+                row = cursor.fetchone()
             
-            row = cursor.fetchone()
             if not row:
                 return None, "Username not found"
             
-            user_id, username, email, password_hash, salt, bankroll, total_wagered, total_won, games_played, games_won, created_at = row
+            user_id, password_hash, salt, iterations = row
             
-            if not self.verify_password(password, password_hash, salt):
+            # Check the password outside the lock so slow hashing never stalls other requests
+            if not self.verify_password(password, password_hash, salt, iterations):
                 return None, "Invalid password"
             
-            # Update last login
-            cursor.execute("UPDATE users SET last_login = CURRENT_TIMESTAMP WHERE id = ?", (user_id,))
-            conn.commit()
+            # Upgrade hex, plain SHA-256 or fewer-round hashes while we have the password
+            new_hash = new_salt = new_iterations = None
+            if iterations < PASSWORD_ITERATIONS or isinstance(salt, str):
+                new_hash, new_salt = self.hash_password(password)
+                new_iterations = PASSWORD_ITERATIONS
+            
+            # Update last login (and any upgraded hash), reading back the user as of this commit
+            with self._write(user_id) as conn:
+                row = conn.execute(f"""
+                    UPDATE users SET password_hash = COALESCE(?, password_hash),
+                                     salt = COALESCE(?, salt),
+                                     password_iterations = COALESCE(?, password_iterations),
+                                     last_login = CURRENT_TIMESTAMP
+                    WHERE id = ?
+                    RETURNING {_USER_COLUMNS}
+                """, (new_hash, new_salt, new_iterations, user_id)).fetchone()
             
-            user = User(
-                id=user_id,
-                username=username,
-                email=email,
-                bankroll=bankroll,
-                total_wagered=total_wagered,
-                total_won=total_won,
-                games_played=games_played,
-                games_won=games_won,
-                created_at=created_at,
-                last_login=datetime.now().isoformat()
-            )
+            if not row:
+                return None, "Username not found"
             
-            conn.close()
-            return user, "Login successful"
+            return User(*row), "Login successful"
             
         except Exception as e:
             return None, f"Login failed: {str(e)}"
@@ -199,345 +450,372 @@ class UserManager:
     def create_session(self, user_id: int) -> str:
         """Create a new user session"""
         session_id = secrets.token_urlsafe(32)
-        expires_at = datetime.now().replace(hour=23, minute=59, second=59).isoformat()  # Expires at end of day
+        # Expires at end of day (local time), as epoch seconds
+        now = time.localtime()
+        expires_at = int(time.mktime((now.tm_year, now.tm_mon, now.tm_mday, 23, 59, 59, 0, 0, -1)))
         
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        
-        cursor.execute("""
-            INSERT OR REPLACE INTO user_sessions (session_id, user_id, expires_at)
-            VALUES (?, ?, ?)
-        """, (session_id, user_id, expires_at))
+        with self._write() as conn:
+            cursor = conn.cursor()
+            
+            cursor.execute("""
+                INSERT OR REPLACE INTO user_sessions (session_id, user_id, expires_at)
+                VALUES (?, ?, ?)
+            """, (session_id, user_id, expires_at))
+            
+            # Sweep sessions that have lapsed while we hold the write lock (an index range delete)
+            self._prune_sessions(cursor)
         
-        conn.commit()
-        conn.close()
         return session_id
     
+    def prune_sessions(self) -> int:
+        """Delete expired sessions; returns how many were removed"""
+        try:
+            with self._write() as conn:
+                return self._prune_sessions(conn.cursor())
+            
+        except Exception:
+            return 0
+    
+    def _prune_sessions(self, cursor) -> int:
+        """Delete expired sessions inside the caller's transaction"""
+        cursor.execute("DELETE FROM user_sessions WHERE expires_at <= ?", (int(time.time()),))
+        return cursor.rowcount
+    
     def get_user_by_session(self, session_id: str) -> Optional[User]:
         """Get user by session ID"""
         try:
-            conn = sqlite3.connect(self.db_path)
-            cursor = conn.cursor()
-            
-            cursor.execute("""
-                SELECT u.id, u.username, u.email, u.bankroll, u.total_wagered, 
-                       u.total_won, u.games_played, u.games_won, u.created_at, u.last_login
-                FROM users u
-                JOIN user_sessions s ON u.id = s.user_id
-                WHERE s.session_id = ? AND s.expires_at > CURRENT_TIMESTAMP
-            """, (session_id,))
-            
-            row = cursor.fetchone()
-            if not row:
+            session = self._session_cache.get(session_id)
+            if session is None:
+                with self._reader() as conn:
+                    row = conn.execute("""
+                        SELECT user_id, expires_at FROM user_sessions WHERE session_id = ?
+                    """, (session_id,)).fetchone()
+                
+                if not row:
+                    return None
+                session = self._session_cache[session_id] = tuple(row)
+            
+            user_id, expires_at = session
+            if expires_at <= time.time():
+                self._session_cache.pop(session_id)
                 return None
             
-            user = User(*row)
-            conn.close()
-            return user
+            # The user row carries the live bankroll, so it comes from the write-invalidated user cache
+            user = self.get_user_by_id(user_id)
+            return User(**user) if user else None
             
         except Exception:
             return None
     
-    def update_bankroll(self, user_id: int, new_bankroll: float) -> bool:
+    def update_bankroll(self, user_id: int, bankroll_cents: int) -> bool:
         """Update user's bankroll"""
         try:
-            conn = sqlite3.connect(self.db_path)
-            cursor = conn.cursor()
-            
-            cursor.execute("UPDATE users SET bankroll = ? WHERE id = ?", (new_bankroll, user_id))
-            
-            conn.commit()
-            conn.close()
-            return True
-            
+            with self._write(user_id) as conn:
+                cursor = conn.cursor()
+                
+                cursor.execute("UPDATE users SET bankroll_cents = ? WHERE id = ?", (bankroll_cents, user_id))
+                
+                return True
+                
         except Exception:
             return False
     
-    def record_game(self, user_id: int, game_id: str, bet_amount: float, 
-                   final_winnings: float, rounds_completed: int, result: str, 
+    def adjust_bankroll(self, user_id: int, delta_cents: int) -> Optional[int]:
+        """Atomically add delta_cents to user's bankroll and return the new balance in cents.
+        Returns None if the user doesn't exist or the balance would go negative."""
+        try:
+            with self._write(user_id) as conn:
+                cursor = conn.cursor()
+                
+                cursor.execute("""
+                    UPDATE users SET bankroll_cents = bankroll_cents + ?
+                    WHERE id = ? AND bankroll_cents + ? >= 0
+                    RETURNING bankroll_cents
+                """, (delta_cents, user_id, delta_cents))
+                
+                row = cursor.fetchone()
+                return row[0] if row else None
+                
+        except Exception:
+            return None
+    
+    def record_game(self, user_id: int, game_id: str, bet_cents: int, 
+                   winnings_cents: int, rounds_completed: int, result: str, 
                    cards_drawn: List = None, strategy_used: str = None) -> bool:
         """Record a completed game"""
+        return self.finalize_game(user_id, game_id, bet_cents, winnings_cents,
+                                  rounds_completed, result, 0, cards_drawn, strategy_used)
+    
+    def finalize_game(self, user_id: int, game_id: str, bet_cents: int, 
+                      winnings_cents: int, rounds_completed: int, result: str, 
+                      bankroll_delta_cents: int, cards_drawn: List = None,
+                      strategy_used: str = None) -> bool:
+        """Record a completed game and credit bankroll_delta_cents in a single transaction"""
         try:
-            profit_loss = final_winnings - bet_amount
-            
-            conn = sqlite3.connect(self.db_path)
-            cursor = conn.cursor()
-            
-            # Insert game record
-            cursor.execute("""
-                INSERT INTO game_records 
-                (user_id, game_id, bet_amount, final_winnings, rounds_completed, 
-                 result, profit_loss, cards_drawn, strategy_used)
-                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
-            """, (user_id, game_id, bet_amount, final_winnings, rounds_completed, 
-                  result, profit_loss, str(cards_drawn) if cards_drawn else '', strategy_used or ''))
-            
-            # Update user statistics
-            cursor.execute("""
-                UPDATE users SET 
-                    total_wagered = total_wagered + ?,
-                    total_won = total_won + ?,
-                    games_played = games_played + 1,
-                    games_won = games_won + ?
-                WHERE id = ?
-            """, (bet_amount, final_winnings, 1 if result == 'won' else 0, user_id))
-            
-            conn.commit()
-            conn.close()
-            return True
-            
+            profit_loss_cents = winnings_cents - bet_cents
+            cards_json = _cards_json(cards_drawn)
+            
+            with self._write(user_id) as conn:
+                cursor = conn.cursor()
+                
+                # Insert game record
+                cursor.execute("""
+                    INSERT INTO game_records 
+                    (user_id, game_id, bet_cents, winnings_cents, rounds_completed, 
+                     result, profit_loss_cents, cards_drawn, strategy_used)
+                    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+                """, (user_id, game_id, bet_cents, winnings_cents, rounds_completed, 
+                      result, profit_loss_cents, cards_json, strategy_used or ''))
+                
+                # trg_game_records_totals has updated the statistics; only the bankroll is left
+                if bankroll_delta_cents:
+                    cursor.execute("UPDATE users SET bankroll_cents = bankroll_cents + ? WHERE id = ?",
+                                   (bankroll_delta_cents, user_id))
+                
+                return True
+                
         except Exception as e:
             # Log error silently - could use proper logging in production
             return False
     
-    def get_user_game_history(self, user_id: int, limit: int = 50) -> List[GameRecord]:
-        """Get user's game history"""
+    def record_games_batch(self, records: List[Dict]) -> bool:
+        """Record many completed games (dicts of finalize_game's arguments) in one transaction.
+        bankroll_delta_cents, cards_drawn and strategy_used are optional per record."""
         try:
-            conn = sqlite3.connect(self.db_path)
-            cursor = conn.cursor()
-            
-            cursor.execute("""
-                SELECT id, user_id, game_id, bet_amount, final_winnings, 
-                       rounds_completed, result, profit_loss, created_at
-                FROM game_records 
-                WHERE user_id = ? 
-                ORDER BY created_at DESC 
-                LIMIT ?
-            """, (user_id, limit))
-            
-            records = []
-            for row in cursor.fetchall():
-                records.append(GameRecord(*row))
+            rows = []
+            deltas = {}  # user_id -> bankroll delta; the trigger keeps the other totals
+            for record in records:
+                user_id = record['user_id']
+                rows.append((user_id, record['game_id'], record['bet_cents'], record['winnings_cents'],
+                             record['rounds_completed'], record['result'],
+                             record['winnings_cents'] - record['bet_cents'],
+                             _cards_json(record.get('cards_drawn')),
+                             record.get('strategy_used') or ''))
+                deltas[user_id] = deltas.get(user_id, 0) + record.get('bankroll_delta_cents', 0)
+            
+            with self._write(*deltas) as conn:
+                conn.executemany("""
+                    INSERT INTO game_records 
+                    (user_id, game_id, bet_cents, winnings_cents, rounds_completed, 
+                     result, profit_loss_cents, cards_drawn, strategy_used)
+                    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+                """, rows)
+                
+                # One bankroll UPDATE per player rather than per game
+                conn.executemany("UPDATE users SET bankroll_cents = bankroll_cents + ? WHERE id = ?",
+                                 [(delta, user_id) for user_id, delta in deltas.items() if delta])
             
-            conn.close()
-            return records
+            return True
             
+        except Exception:
+            return False
+    
+    def get_user_game_history(self, user_id: int, limit: int = 50,
+                              before_id: Optional[int] = None) -> List[GameRecord]:
+        """Get user's game history, newest first; pass the last record's id as before_id for the next page"""
+        return [GameRecord(*row) for row in self._fetch_game_history(user_id, limit, before_id)]
+    
+    def _fetch_game_history(self, user_id: int, limit: int, before_id: Optional[int]) -> List[sqlite3.Row]:
+        """One page of a user's game_records rows, newest first"""
+        try:
+            with self._reader() as conn:
+                return conn.execute(f"""
+                    SELECT {_GAME_RECORD_COLUMNS}
+                    FROM game_records 
+                    WHERE user_id = ? AND id < ?
+                    ORDER BY id DESC 
+                    LIMIT ?
+                """, (user_id, _MAX_ROWID if before_id is None else before_id, limit)).fetchall()
+                
         except Exception:
             return []
     
     def get_user_stats(self, user_id: int) -> Dict:
         """Get comprehensive user statistics"""
         try:
-            conn = sqlite3.connect(self.db_path)
-            cursor = conn.cursor()
-            
-            # Basic stats
-            cursor.execute("""
-                SELECT bankroll, total_wagered, total_won, games_played, games_won
-                FROM users WHERE id = ?
-            """, (user_id,))
-            
-            user_stats = cursor.fetchone()
-            if not user_stats:
-                return {}
-            
-            bankroll, total_wagered, total_won, games_played, games_won = user_stats
-            
-            # Recent performance
-            cursor.execute("""
-                SELECT result, COUNT(*) as count
-                FROM game_records 
-                WHERE user_id = ? AND created_at > datetime('now', '-7 days')
-                GROUP BY result
-            """, (user_id,))
-            
-            recent_results = dict(cursor.fetchall())
-            
-            # Best and worst sessions
-            cursor.execute("""
-                SELECT MAX(profit_loss) as best_win, MIN(profit_loss) as worst_loss
-                FROM game_records WHERE user_id = ?
-            """, (user_id,))
-            
-            win_loss = cursor.fetchone()
-            best_win, worst_loss = win_loss if win_loss else (0, 0)
-            
-            # Calculate derived stats
-            win_rate = (games_won / games_played * 100) if games_played > 0 else 0
-            net_profit = total_won - total_wagered
-            rtp = (total_won / total_wagered * 100) if total_wagered > 0 else 0
-            
-            conn.close()
-            
-            return {
-                'bankroll': bankroll,
-                'total_wagered': total_wagered,
-                'total_won': total_won,
-                'net_profit': net_profit,
-                'games_played': games_played,
-                'games_won': games_won,
-                'win_rate': win_rate,
-                'rtp': rtp,
-                'best_win': best_win or 0,
-                'worst_loss': worst_loss or 0,
-                'recent_results': recent_results
-            }
-            
+            with self._reader() as conn:
+                # Basic stats, best/worst game and the last 7 days' results in one statement
+                user_stats = conn.execute("""
+                    WITH recent AS (
+                        SELECT result, COUNT(*) AS count
+                        FROM game_records 
+                        WHERE user_id = :user_id AND created_at > datetime('now', '-7 days')
+                        GROUP BY result
+                    ),
+                    best_worst AS (
+                        SELECT MAX(profit_loss_cents) AS best_win, MIN(profit_loss_cents) AS worst_loss
+                        FROM game_records WHERE user_id = :user_id
+                    )
+                    SELECT u.bankroll_cents, u.total_wagered_cents, u.total_won_cents, u.games_played, u.games_won,
+                           b.best_win, b.worst_loss,
+                           (SELECT json_group_object(result, count) FROM recent) AS recent_results
+                    FROM users u, best_worst b
+                    WHERE u.id = :user_id
+                """, {'user_id': user_id}).fetchone()
+                
+                if not user_stats:
+                    return {}
+                
+                (bankroll_cents, total_wagered_cents, total_won_cents, games_played, games_won,
+                 best_win, worst_loss, recent_results) = user_stats
+                recent_results = json.loads(recent_results)
+                
+                # Calculate derived stats
+                win_rate = (games_won / games_played * 100) if games_played > 0 else 0
+                net_profit_cents = total_won_cents - total_wagered_cents
+                rtp = (total_won_cents / total_wagered_cents * 100) if total_wagered_cents > 0 else 0
+                
+                return {
+                    'bankroll_cents': bankroll_cents,
+                    'total_wagered_cents': total_wagered_cents,
+                    'total_won_cents': total_won_cents,
+                    'net_profit_cents': net_profit_cents,
+                    'games_played': games_played,
+                    'games_won': games_won,
+                    'win_rate': win_rate,
+                    'rtp': rtp,
+                    'best_win_cents': best_win or 0,
+                    'worst_loss_cents': worst_loss or 0,
+                    'recent_results': recent_results
+                }
+                
         except Exception:
             return {}
     
-    def claim_daily_bonus(self, user_id: int) -> float:
-        """Simplified daily bonus for app.py compatibility"""
+    def claim_daily_bonus(self, user_id: int) -> int:
+        """Simplified daily bonus for app.py compatibility; returns the bonus in cents"""
         try:
-            conn = sqlite3.connect(self.db_path)
-            cursor = conn.cursor()
-            
-            # Check if already claimed today
-            today = datetime.now().strftime('%Y-%m-%d')
-            cursor.execute("""
-                SELECT id FROM daily_bonuses 
-                WHERE user_id = ? AND claimed_date = ?
-            """, (user_id, today))
-            
-            if cursor.fetchone():
-                return 0  # Already claimed
+            # Check if already claimed today (the usual case on a landing page visit) without
+            # taking the write lock
+            today = time.strftime('%Y-%m-%d')
+            with self._reader() as conn:
+                if conn.execute("""
+                    SELECT 1 FROM daily_bonuses 
+                    WHERE user_id = ? AND claimed_date = ?
+                """, (user_id, today)).fetchone():
+                    return 0  # Already claimed
             
             # Calculate bonus (base $50 + random $0-50)
-            import random
-            bonus_amount = 50 + random.randint(0, 50)
-            
-            # Add bonus to bankroll
-            cursor.execute("""
-                UPDATE users SET bankroll = bankroll + ? WHERE id = ?
-            """, (bonus_amount, user_id))
-            
-            # Record bonus claim
-            cursor.execute("""
-                INSERT INTO daily_bonuses (user_id, bonus_amount, claimed_date)
-                VALUES (?, ?, ?)
-            """, (user_id, bonus_amount, today))
-            
-            conn.commit()
-            conn.close()
-            
-            return bonus_amount
-            
+            bonus_cents = (50 + random.randint(0, 50)) * 100
+            
+            with self._write(user_id) as conn:
+                cursor = conn.cursor()
+                
+                # Record bonus claim; the unique (user_id, claimed_date) index makes a
+                # concurrent second claim a no-op instead of a second payout
+                cursor.execute("""
+                    INSERT OR IGNORE INTO daily_bonuses (user_id, bonus_cents, claimed_date)
+                    VALUES (?, ?, ?)
+                """, (user_id, bonus_cents, today))
+                
+                if cursor.rowcount == 0:
+                    return 0  # Claimed by another request just now
+                
+                # Add bonus to bankroll
+                cursor.execute("""
+                    UPDATE users SET bankroll_cents = bankroll_cents + ? WHERE id = ?
+                """, (bonus_cents, user_id))
+                
+                return bonus_cents
+                
         except Exception:
             return 0
     
-    def add_funds(self, user_id: int, amount: float) -> bool:
+    def add_funds(self, user_id: int, amount_cents: int) -> bool:
         """Add funds to user's bankroll (for testing/admin purposes)"""
         try:
-            conn = sqlite3.connect(self.db_path)
-            cursor = conn.cursor()
-            
-            cursor.execute("""
-                UPDATE users SET bankroll = bankroll + ? WHERE id = ?
-            """, (amount, user_id))
-            
-            conn.commit()
-            conn.close()
-            return True
-            
+            with self._write(user_id) as conn:
+                cursor = conn.cursor()
+                
+                cursor.execute("""
+                    UPDATE users SET bankroll_cents = bankroll_cents + ? WHERE id = ?
+                """, (amount_cents, user_id))
+                
+                return True
+                
         except Exception:
             return False
     
     def get_leaderboard(self, limit: int = 10) -> List[Dict]:
         """Get top players by net profit"""
+        return list(self.iter_leaderboard(limit))
+    
+    def iter_leaderboard(self, limit: int = 10) -> Iterator[Dict]:
+        """Yield top players by net profit one row at a time (for streamed pages)"""
         try:
-            conn = sqlite3.connect(self.db_path)
-            cursor = conn.cursor()
-            
-            cursor.execute("""
-                SELECT username, bankroll, total_won - total_wagered as net_profit,
-                       games_played, games_won,
-                       ROUND(CAST(games_won AS FLOAT) / games_played * 100, 1) as win_rate
-                FROM users 
-                WHERE games_played > 0
-                ORDER BY net_profit DESC 
-                LIMIT ?
-            """, (limit,))
-            
-            leaderboard = []
-            for row in cursor.fetchall():
-                username, bankroll, net_profit, games_played, games_won, win_rate = row
-                leaderboard.append({
+            # Fetch everything, then yield, so a streamed page never holds a pooled connection
+            with self._reader() as conn:
+                rows = conn.execute("""
+                    SELECT id, username, bankroll_cents, total_won_cents - total_wagered_cents as net_profit_cents,
+                           games_played, games_won,
+                           ROUND(CAST(games_won AS FLOAT) / games_played * 100, 1) as win_rate
+                    FROM users 
+                    WHERE games_played > 0
+                    ORDER BY net_profit_cents DESC 
+                    LIMIT ?
+                """, (limit,)).fetchall()
+            
+            for row in rows:
+                user_id, username, bankroll_cents, net_profit_cents, games_played, games_won, win_rate = row
+                yield {
+                    'id': user_id,
                     'username': username,
-                    'bankroll': bankroll,
-                    'net_profit': net_profit,
+                    'bankroll_cents': bankroll_cents,
+                    'net_profit_cents': net_profit_cents,
                     'games_played': games_played,
                     'games_won': games_won,
                     'win_rate': win_rate
-                })
-            
-            conn.close()
-            return leaderboard
-            
-        except Exception:
-            return []
+                }
+        
+        except sqlite3.Error:
+            return
     
     # Alias methods for compatibility with app.py
-    def create_user(self, username: str, email: str, password: str, starting_bankroll: float = 1000.0) -> tuple[bool, str]:
+    def create_user(self, username: str, email: str, password: str, starting_bankroll_cents: int = STARTING_BANKROLL_CENTS) -> tuple[bool, str]:
         """Alias for register_user"""
-        return self.register_user(username, email, password, starting_bankroll)
+        return self.register_user(username, email, password, starting_bankroll_cents)
     
-    def authenticate_user(self, username: str, password: str) -> bool:
-        """Authenticate user and return True/False"""
+    def authenticate_user(self, username: str, password: str) -> Optional[Dict]:
+        """Authenticate user and return their row as a dict, or None on failure"""
         user, message = self.login_user(username, password)
-        return user is not None
+        return asdict(user) if user else None
     
     def get_user_by_username(self, username: str) -> Optional[Dict]:
         """Get user by username, returning dict format"""
-        try:
-            conn = sqlite3.connect(self.db_path)
-            cursor = conn.cursor()
-            
-            cursor.execute("""
-                SELECT id, username, email, bankroll, total_wagered, total_won, 
-                       games_played, games_won, created_at, last_login
-                FROM users WHERE username = ?
-            """, (username,))
-            
-            row = cursor.fetchone()
-            if not row:
-                return None
-            
-            conn.close()
-            return {
-                'id': row[0],
-                'username': row[1],
-                'email': row[2],
-                'bankroll': row[3],
-                'total_wagered': row[4],
-                'total_won': row[5],
-                'games_played': row[6],
-                'games_won': row[7],
-                'created_at': row[8],
-                'last_login': row[9]
-            }
-            
-        except Exception:
-            return None
+        user_id = self._user_ids.get(username)
+        if user_id is not None:
+            return self.get_user_by_id(user_id)
+        
+        user = self._load_user("username = ?", username)
+        if user is not None:
+            self._user_ids[username] = user['id']
+        return user
     
     def get_user_by_id(self, user_id: int) -> Optional[Dict]:
         """Get user by ID, returning dict format"""
+        user = self._user_cache.get(user_id)
+        if user is not None:
+            return dict(user)  # callers may modify their copy
+        return self._load_user("id = ?", user_id)
+    
+    def _load_user(self, where: str, param) -> Optional[Dict]:
+        """Read one user row on a pooled reader and cache it by id"""
         try:
-            conn = sqlite3.connect(self.db_path)
-            cursor = conn.cursor()
-            
-            cursor.execute("""
-                SELECT id, username, email, bankroll, total_wagered, total_won, 
-                       games_played, games_won, created_at, last_login
-                FROM users WHERE id = ?
-            """, (user_id,))
+            generation = self._user_cache_generation
+            with self._reader() as conn:
+                row = conn.execute(f"""
+                    SELECT {_USER_COLUMNS} FROM users WHERE {where}
+                """, (param,)).fetchone()
             
-            row = cursor.fetchone()
             if not row:
                 return None
             
-            conn.close()
-            return {
-                'id': row[0],
-                'username': row[1],
-                'email': row[2],
-                'bankroll': row[3],
-                'total_wagered': row[4],
-                'total_won': row[5],
-                'games_played': row[6],
-                'games_won': row[7],
-                'created_at': row[8],
-                'last_login': row[9]
-            }
+            user = dict(row)
+            # Skip caching if a write landed while we were reading; the row may predate it
+            with self._user_cache_lock:
+                if self._cache_users and generation == self._user_cache_generation:
+                    self._user_cache[user['id']] = user
+            return dict(user)
             
         except Exception:
             return None
@@ -546,37 +824,7 @@ class UserManager:
         """Alias for get_user_stats"""
         return self.get_user_stats(user_id)
     
-    def get_game_history(self, user_id: int, limit: int = 50) -> List[Dict]:
-        """Get user's game history, returning dict format"""
-        try:
-            conn = sqlite3.connect(self.db_path)
-            cursor = conn.cursor()
-            
-            cursor.execute("""
-                SELECT id, user_id, game_id, bet_amount, final_winnings, 
-                       rounds_completed, result, profit_loss, created_at
-                FROM game_records 
-                WHERE user_id = ? 
-                ORDER BY created_at DESC 
-                LIMIT ?
-            """, (user_id, limit))
-            
-            records = []
-            for row in cursor.fetchall():
-                records.append({
-                    'id': row[0],
-                    'user_id': row[1],
-                    'game_id': row[2],
-                    'bet_amount': row[3],
-                    'final_winnings': row[4],
-                    'rounds_completed': row[5],
-                    'result': row[6],
-                    'profit_loss': row[7],
-                    'created_at': row[8]
-                })
-            
-            conn.close()
-            return records
-            
-        except Exception:
-            return []
\ No newline at end of file
+    def get_game_history(self, user_id: int, limit: int = 50,
+                         before_id: Optional[int] = None) -> List[Dict]:
+        """Get user's game history, returning dict format (paged like get_user_game_history)"""
+        return [dict(row) for row in self._fetch_game_history(user_id, limit, before_id)]
\ No newline at end of file